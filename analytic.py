@@ -0,0 +1,487 @@
+"""
+Works out the outcome of simple encounters exactly instead of by sampling. The encounter
+is turned into a Markov chain held as a dense NumPy array of probabilities, with an axis
+for the HP of each monster, the roll of the rogue's sneak attack dice, the fighter's
+rerolls and the damage each PC has taken. Every turn shifts probability along those axes
+by the actor's damage dice weighted by its chance to hit or save, until all of it has
+ended in a party win or a party wipe.
+
+A PC's HP is rolled when it is built, so instead of tracking it the chain tracks the
+damage the PC has taken and uses the distribution of its HP roll for the chance that
+the damage killed it. That only holds while nobody heals, so parties with a cleric or a
+fighter of level 18 or higher, mixed groups of monsters, and encounters whose array
+grows past max_cells are left to estimate(), which falls back to simulation.
+
+Note: numpy must be installed to use this module.
+"""
+
+from collections import defaultdict
+from itertools import combinations, permutations
+from math import comb, factorial, gcd
+import numpy as np
+from handbook import HandBook as HB, Battle
+from encounter import Encounter
+from runner import tally_many
+
+class Unsupported(Exception):
+    """Raised for encounters the exact engine cannot solve."""
+
+def dice_pmf(n, s):
+    """
+    Returns:
+        dict, {total: probability} of rolling n dice with s sides
+    """
+    pmf = {0: 1.0}
+    for die in range(n):
+        step = defaultdict(float)
+        for total, p in pmf.items():
+            for face in range(1, s + 1):
+                step[total + face] += p / s
+        pmf = step
+    return dict(pmf)
+
+def hit_chance(bonus, ac, crit=20):
+    """
+    The chance that HandBook.make_attack hits: a roll at or above crit always hits, a
+    1 always misses and anything else hits when the roll + bonus meets the AC.
+    """
+    hits = sum(1 for roll in range(1, 21)
+                if roll >= crit or (roll != 1 and roll + bonus >= ac))
+    return hits / 20
+
+def save_chance(bonus, dc):
+    # the chance that HandBook.save_roll succeeds
+    return sum(1 for roll in range(1, 21) if roll == 20 or roll + bonus >= dc) / 20
+
+def save_damage(damage, saved, effect=None):
+    # the damage make_save deals, a failed save only hurts when it comes with a status
+    if not damage:
+        return 0
+    if saved:
+        return int(damage/2) + 1
+    return damage if effect else 0
+
+class ExactEncounter(Encounter):
+    """
+    Solves an encounter of a party against one kind of monster exactly.
+
+    The array has the shape [monster HP + 1] * number of monsters + [sneak attack rolls,
+    fighter rerolls + 1] + [damage steps + 1 for each PC], and one array is kept for
+    every initiative order. A PC's damage axis counts in steps of the greatest common
+    divisor of the damage the monster can deal it, and its last index holds the PC once
+    it has fallen.
+
+    Attributes:
+        protagonists, level, antagonists: as for Encounter
+        max_cells: int, the largest the arrays may grow before giving up
+        tol: float, the probability left unresolved at which the chain stops
+    """
+
+    def __init__(self, protagonists, level, antagonists, max_cells=4000000, tol=1e-9):
+        super().__init__(protagonists, level, antagonists)
+        self.tol = tol
+
+        if len(antagonists) != 1:
+            raise Unsupported('only one kind of monster can be solved exactly')
+        self.battle = Battle()
+        self.load_creatures()
+        self.build_party()
+        self.build_monsters()
+        self.pcs = list(self.new_party.values())
+        self.names = list(self.new_party.keys())
+        self.mob = list(self.new_monsters.values())[0].mob
+        self.n = sum(antagonists.values())
+        self.P = len(self.pcs)
+        if any(pc.name == 'cleric' for pc in self.pcs):
+            raise Unsupported('the cleric heals the party')
+        if any(pc.name == 'fighter' and pc.level >= 18 for pc in self.pcs):
+            raise Unsupported('the fighter heals itself')
+
+        # the rogue's sneak attack dice are rolled once per fight
+        self.xs, self.px, self.rerolls = [0], [1.0], 0
+        for pc in self.pcs:
+            if pc.name == 'rogue':
+                pmf = dice_pmf(pc.sneak, 6)
+                self.xs = [d + pc.atk for d in pmf]
+                self.px = list(pmf.values())
+            elif pc.name == 'fighter':
+                self.rerolls = pc.reroll
+
+        # the HP roll of each PC as a cumulative distribution, cdf[hp] = P(HP <= hp)
+        self.hp_cdf, self.steps, pc_shape = [], [], []
+        for pc in self.pcs:
+            die = 6 if pc.name == 'wizard' else 8
+            con = pc.bonus['con']
+            base = die + con + self.level * con
+            pmf = np.zeros(base + self.level * die + 1)
+            for hp, p in dice_pmf(self.level, die).items():
+                pmf[base + hp] = p
+            cdf = np.cumsum(pmf)
+            step = 0
+            for dmg in self.damage_to(pc):
+                step = gcd(step, dmg)
+            step = step or len(cdf)
+            self.hp_cdf.append(cdf)
+            self.steps.append(step)
+            pc_shape.append((len(cdf) - 2) // step + 2)
+
+        self.orders, self.weights = self.initiative()
+        self.shape = [self.mob.hp + 1] * self.n + [len(self.xs), self.rerolls + 1] + pc_shape
+        self.ndim = len(self.shape)
+        if int(np.prod(self.shape)) * len(self.orders) > max_cells:
+            raise Unsupported(f'more than {max_cells} states')
+        self.X, self.R = self.n, self.n + 1
+        self.matrices = {}
+
+        # which monsters and PCs are still standing in each cell of the array
+        standing = np.arange(self.mob.hp + 1) > 0
+        self.m_alive = [self.along(standing, j) for j in range(self.n)]
+        self.m_living = sum(self.m_alive)
+        self.pc_alive = [self.along(np.arange(size) < size - 1, self.pc_axis(i))
+                            for i, size in enumerate(pc_shape)]
+        self.pc_living = sum(self.pc_alive)
+
+    def damage_to(self, pc):
+        # every amount of damage the monster can deal a PC
+        mob = self.mob
+        for a in range(1, mob.actions + 1):
+            dmg = mob.attacks[str(a)] + mob.atk
+            yield int(dmg/2) + 1 if pc.dodge else dmg
+        special = mob.special
+        if special['name'] and special['targets'] != 'self':
+            for saved in (True, False):
+                yield save_damage(special['dmg'], saved, special['effect'])
+
+    def initiative(self):
+        """
+        Lists the initiative orders and their chances.
+
+        Returns:
+            list, the orders as lists of ('pc', i) and ('monster', j)
+            list, the chance of each order
+        """
+        P, C = self.P, self.P + self.n
+        orders, weights = [], []
+        # a lone monster only cares which PCs act before it in the round, since the
+        # PCs' attacks on it add up the same in any order
+        if self.n == 1:
+            for k in range(P + 1):
+                for before in combinations(range(P), k):
+                    after = [i for i in range(P) if i not in before]
+                    orders.append([('pc', i) for i in before] + [('monster', 0)] +
+                                    [('pc', i) for i in after])
+                    weights.append(1 / ((P + 1) * comb(P, k)))
+        else:
+            for seats in permutations(range(C), P):
+                order = [None] * C
+                for i, seat in enumerate(seats):
+                    order[seat] = ('pc', i)
+                monsters = iter(range(self.n))
+                orders.append([o if o else ('monster', next(monsters)) for o in order])
+                weights.append(factorial(self.n) / factorial(C))
+        return orders, weights
+
+    def pc_axis(self, i):
+        return self.n + 2 + i
+
+    def along(self, vector, axis):
+        # shapes a vector so it broadcasts along one axis of the array
+        shape = [1] * self.ndim
+        shape[axis] = len(vector)
+        return np.asarray(vector).reshape(shape)
+
+    def at(self, axis, start, stop):
+        # the index of a slice of one axis of the array
+        return (slice(None),) * axis + (slice(start, stop),)
+
+    def move(self, A, axis, T):
+        # applies the transition matrix T to one axis of the array
+        return np.moveaxis(np.moveaxis(A, axis, -1) @ T, -1, axis)
+
+    def monster_matrix(self, pmf):
+        """
+        The transition matrix of a monster's HP when it takes damage, negative damage
+        heals it up to its full HP and a dead monster stays dead.
+
+        Attributes:
+            pmf: dict, {damage: probability}
+        """
+        key = ('monster',) + tuple(sorted(pmf.items()))
+        if key not in self.matrices:
+            hp = np.arange(self.mob.hp + 1)
+            T = np.zeros((len(hp), len(hp)))
+            for dmg, p in pmf.items():
+                T[hp, np.where(hp > 0, np.clip(hp - dmg, 0, self.mob.hp), 0)] += p
+            self.matrices[key] = T
+        return self.matrices[key]
+
+    def pc_matrix(self, i, pmf):
+        """
+        The transition matrix of the damage PC i has taken, a PC falls with the chance
+        that its HP roll could not take the damage.
+
+        Attributes:
+            pmf: dict, {damage: probability}
+        """
+        key = ('pc', i) + tuple(sorted(pmf.items()))
+        if key not in self.matrices:
+            step, cdf = self.steps[i], self.hp_cdf[i]
+            dead = self.shape[self.pc_axis(i)] - 1
+            k = np.arange(dead)
+            T = np.zeros((dead + 1, dead + 1))
+            T[dead, dead] = 1
+            for dmg, p in pmf.items():
+                taken = np.minimum((k * step) + dmg, len(cdf) - 1)
+                lived = (1 - cdf[taken]) / (1 - cdf[k * step])
+                to = k + dmg // step
+                stays = to < dead
+                T[k[stays], to[stays]] += p * lived[stays]
+                T[k, dead] += p * (1 - lived)
+            self.matrices[key] = T
+        return self.matrices[key]
+
+    def targets(self, A, living, alive):
+        """
+        Splits A between the targets of an action aimed at a random living combatant.
+
+        Returns:
+            array, the part of A with nobody left to target
+            list, the part of A aimed at each combatant
+        """
+        share = np.divide(1.0, living, out=np.zeros(living.shape), where=living > 0)
+        return A * (living == 0), [A * (a * share) for a in alive]
+
+    def pc_attack(self, A, bonus, damage, crit=20, sneak=False):
+        """
+        A PC attacking a random living monster.
+
+        Attributes:
+            damage: dict, {damage: probability} before the bonus is added
+            sneak: boolean, True to add the rogue's sneak attack dice
+        """
+        chance = hit_chance(bonus, self.mob.ac, crit)
+        out, aimed = self.targets(A, self.m_living, self.m_alive)
+        for xi, x in (enumerate(self.xs) if sneak else [(None, 0)]):
+            pmf = defaultdict(float, {0: 1 - chance})
+            for d, q in damage.items():
+                total = d + bonus + x
+                if self.mob.dodge:
+                    total = int(total/2) + 1
+                pmf[total] += chance * q
+            T = self.monster_matrix(pmf)
+            index = self.at(self.X, xi, xi + 1) if sneak else Ellipsis
+            for j, Aj in enumerate(aimed):
+                out[index] += self.move(Aj[index], j, T)
+        return out
+
+    def monster_save(self, A, j, dc, stype, damage):
+        # monster j saving against one of the wizard's spells
+        chance = save_chance(self.mob.saves[stype], dc)
+        pmf = defaultdict(float)
+        pmf[save_damage(damage, True)] += chance
+        pmf[save_damage(damage, False)] += 1 - chance
+        return self.move(A, j, self.monster_matrix(pmf))
+
+    def pc_save(self, A, i, dc, stype, damage, effect):
+        # PC i saving against a monster's special, the fighter spending its rerolls
+        pc = self.pcs[i]
+        chance = save_chance(pc.saves[stype], dc)
+        if pc.name == 'fighter':
+            at = self.at
+            saved, failed = np.zeros_like(A), np.zeros_like(A)
+            for r in range(self.rerolls + 1):
+                part, miss = A[at(self.R, r, r + 1)], 1.0
+                for used in range(r + 1):
+                    saved[at(self.R, r - used, r - used + 1)] += part * (miss * chance)
+                    miss *= 1 - chance
+                failed[at(self.R, 0, 1)] += part * miss
+            axis = self.pc_axis(i)
+            return (self.move(saved, axis, self.pc_matrix(i, {
+                        save_damage(damage, True, effect): 1.0})) +
+                    self.move(failed, axis, self.pc_matrix(i, {
+                        save_damage(damage, False, effect): 1.0})))
+        pmf = defaultdict(float)
+        pmf[save_damage(damage, True, effect)] += chance
+        pmf[save_damage(damage, False, effect)] += 1 - chance
+        return self.move(A, self.pc_axis(i), self.pc_matrix(i, pmf))
+
+    def wizard(self, i, pc, A):
+        # Wizard.take_action, it has cast one spell in each round before this one
+        seq = self.spell_order(pc)
+        spells = HB.wizard_spells
+        if self.round < len(seq):
+            s = seq[self.round]
+            crowd = np.zeros_like(A)
+            if s > 2:
+                crowd = A * (self.m_living > 2)
+                A = A - crowd
+                spell = spells['all'][s]
+                for j in range(self.n):
+                    crowd = self.monster_save(crowd, j, pc.dc, spell['save'],
+                                                spell['dmg'] + pc.spell_atk)
+            spell = spells['one'][s]
+            dmg = spell['dmg'] + pc.spell_atk
+            if spell['type'] == 'attack':
+                return crowd + self.pc_attack(A, pc.spell_atk, {dmg: 1.0})
+            out, aimed = self.targets(A, self.m_living, self.m_alive)
+            for j, Aj in enumerate(aimed):
+                out += self.monster_save(Aj, j, pc.dc, spell['save'], dmg)
+            return crowd + out
+        if self.level >= 13:
+            out, aimed = self.targets(A, self.m_living, self.m_alive)
+            for j, Aj in enumerate(aimed):
+                for d, q in dice_pmf(7, 8).items():
+                    out += self.monster_save(Aj * q, j, pc.dc, 'con', 30 + pc.spell_atk + d)
+            return out
+        return self.pc_attack(A, pc.atk, dice_pmf(1, 8))
+
+    def spell_order(self, pc):
+        # the spell levels the wizard casts in order; it always spends its highest slot
+        slots = list(pc.spell_slots)
+        order = []
+        while slots:
+            order.append(len(slots) - 1)
+            if slots[-1] == 1:
+                slots.pop()
+            else:
+                slots[-1] -= 1
+        return order
+
+    def fighter(self, i, pc, A):
+        # Fighter.take_action below level 18, the surges all go on the first turn
+        swings = pc.actions
+        if self.round == 0 and pc.actions > 1:
+            swings += pc.surge
+        for swing in range(swings):
+            A = self.pc_attack(A, pc.atk, dice_pmf(1, 10), pc.crit)
+        return A
+
+    def rogue(self, i, pc, A):
+        # Rogue.take_action
+        for swing in range(2 if self.round == 0 and self.level >= 17 else 1):
+            A = self.pc_attack(A, pc.atk, dice_pmf(1, 8), pc.crit, sneak=True)
+        return A
+
+    def monster(self, j, A):
+        # CreatureFeature.take_action for monster j
+        mob = self.mob
+        special = mob.special
+        if (special['name'] and self.round % special['cooldown'] == 0
+                and special['targets'] != 'self'):
+            save = (special['dc'], special['save'], special['dmg'], special['effect'])
+            if special['targets'] == 'all':
+                for i in range(self.P):
+                    alive = A * self.pc_alive[i]
+                    A = A - alive + self.pc_save(alive, i, *save)
+                return A
+            out, aimed = self.targets(A, self.pc_living, self.pc_alive)
+            for i, Ai in enumerate(aimed):
+                out += self.pc_save(Ai, i, *save)
+            return out
+
+        healed = np.zeros_like(A)
+        if special['name'] and special['targets'] == 'self':
+            low = A * self.along(np.arange(mob.hp + 1) <= int(mob.hp/2), j)
+            healed = self.move(low, j, self.monster_matrix({-special['dmg']: 1.0}))
+            A = A - low
+        for a in range(1, mob.actions + 1):
+            dmg = mob.attacks[str(a)] + mob.atk
+            out, aimed = self.targets(A, self.pc_living, self.pc_alive)
+            for i, Ai in enumerate(aimed):
+                chance = hit_chance(mob.atk, self.pcs[i].ac)
+                hit = int(dmg/2) + 1 if self.pcs[i].dodge else dmg
+                T = self.pc_matrix(i, {0: 1 - chance, hit: chance})
+                out += self.move(Ai, self.pc_axis(i), T)
+            A = out
+        return A + healed
+
+    def start(self):
+        """
+        The arrays the encounter starts from, one for each initiative order, holding the
+        chance of the order for every roll of the rogue's sneak attack dice.
+        """
+        tables = []
+        for w in self.weights:
+            t = np.zeros(self.shape)
+            t[(self.mob.hp,) * self.n + (slice(None), self.rerolls) + (0,) * self.P] = (
+                np.multiply(self.px, w))
+            tables.append(t)
+        return tables
+
+    def solve(self):
+        """
+        Runs the chain until every fight is decided.
+
+        Returns:
+            dict, the chance the party wins, the chance each PC survives a win, the
+                expected number of survivors and rounds, and the probability left
+                undecided
+        """
+        tables = self.start()
+        turns = {'wizard': self.wizard, 'fighter': self.fighter, 'rogue': self.rogue}
+        wiped = (Ellipsis,) + tuple(size - 1 for size in self.shape[self.n + 2:])
+        cleared = (0,) * self.n
+        results = {'method': 'exact', 'win': 0.0}
+        results.update({name: 0.0 for name in self.names})
+        lost = rounds = 0.0
+
+        self.round = 0
+        while True:
+            for pos in range(self.P + self.n):
+                # takes the fights that are over out of the chain
+                left = 0.0
+                for t in tables:
+                    p = float(t[wiped].sum())
+                    t[wiped] = 0
+                    lost += p
+                    won = t[cleared]
+                    w = float(won.sum())
+                    results['win'] += w
+                    for i, name in enumerate(self.names):
+                        results[name] += float(won[self.at(2 + i, 0, -1)].sum())
+                    rounds += (p + w) * (self.round + (pos > 0))
+                    t[cleared] = 0
+                    left += float(t.sum())
+                if left < self.tol:
+                    results['survivors'] = sum(results[name] for name in self.names)
+                    results['rounds'] = rounds
+                    results['undecided'] = left
+                    return results
+
+                for o, t in enumerate(tables):
+                    kind, k = self.orders[o][pos]
+                    if kind == 'monster':
+                        A = t * self.m_alive[k]
+                        tables[o] = t - A + self.monster(k, A)
+                    else:
+                        pc = self.pcs[k]
+                        A = t * self.pc_alive[k]
+                        tables[o] = t - A + turns[pc.name](k, pc, A)
+            self.round += 1
+
+def estimate(protagonists, level, antagonists, iterations=10000, seed=None, **kwargs):
+    """
+    Solves the encounter exactly when it can, and otherwise estimates the same figures
+    by running it through runner.tally_many(). A simulated fight always ends, so none of
+    it is left undecided.
+
+    Returns:
+        dict, as ExactEncounter.solve() with 'method' set to 'exact' or 'simulation'
+    """
+    try:
+        return ExactEncounter(protagonists, level, antagonists, **kwargs).solve()
+    except Unsupported:
+        pass
+
+    tally = tally_many(protagonists, level, antagonists, iterations, seed=seed)
+    results = {'method': 'simulation', 'win': tally.win_rate()}
+    names = []
+    for p in protagonists:
+        if p.lower() in ('cleric', 'fighter', 'rogue', 'wizard') and p.lower() not in names:
+            names.append(p.lower())
+    for name in names:
+        results[name] = tally.survival_rate(name)
+    results['survivors'] = sum(results[name] for name in names)
+    results['rounds'] = tally.mean
+    results['undecided'] = 0.0
+    return results
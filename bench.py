@@ -0,0 +1,183 @@
+"""
+Benchmarks the simulator so a change can be checked for speeding it up or slowing it
+down. The suite times:
+
+    combat: whole Encounter.combat() iterations per second, for each scenario and level
+    build: Encounter.build_encounter() on its own, for each scenario and level
+    micro: the hot path operations roll_dice, make_attack, is_dead and get_target
+
+Every benchmark repeats its work until it has run for a minimum time, takes the best of a
+few repeats and reports the operations per second and the microseconds per operation.
+The results are written as JSON together with the commit and Python they were taken on,
+and two such files can be compared to spot regressions.
+
+Run with:
+    python bench.py [--quick] [--out bench.json]
+    python bench.py --compare old.json new.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from dice import Dice
+from encounter import Encounter
+from runner import iteration_seed
+
+CHARACTERS = ['cleric', 'fighter', 'rogue', 'wizard']
+
+SCENARIOS = {
+    'worg-goblin': {'Worg': 3, 'Goblin': 7},
+    'ancient-red-dragon': {'Ancient Red Dragon': 1},
+    'swarm-40': {'Goblin': 40}
+    }
+
+LEVELS = (1, 5, 11, 20)
+
+def time_it(step, min_time=0.2, repeat=3):
+    """
+    Times step() by calling it until min_time has passed, repeat times over.
+
+    Attributes:
+        step: callable, does one operation each call
+        min_time: float, the seconds each repeat runs for at least
+        repeat: int, the number of repeats, the fastest of which is kept
+
+    Returns:
+        dict, the operations per second and microseconds per operation of the fastest
+            repeat and the operations run over all repeats
+    """
+    best = None
+    total = 0
+    for r in range(repeat):
+        ops = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time:
+            step()
+            ops += 1
+            elapsed = time.perf_counter() - start
+        total += ops
+        rate = ops / elapsed
+        best = rate if best is None else max(best, rate)
+    return {'ops_per_sec': best, 'us_per_op': 1e6 / best, 'ops': total}
+
+def bench_combat(level, antagonists, seed=0, **kwargs):
+    # whole iterations, each with its own dice as runner.py rolls them
+    index = 0
+
+    def step():
+        nonlocal index
+        dice = Dice(iteration_seed(seed, index))
+        Encounter(CHARACTERS, level, antagonists, dice).combat()
+        index += 1
+
+    return time_it(step, **kwargs)
+
+def bench_build(level, antagonists, seed=0, **kwargs):
+    # the party, the monsters and the initiative, without the fight
+    encounter = Encounter(CHARACTERS, level, antagonists, Dice(seed))
+    return time_it(encounter.build_encounter, **kwargs)
+
+def micro_benchmarks(level=10, seed=0, **kwargs):
+    """
+    Times the operations every turn of combat goes through, on a built encounter whose
+    combatants are given HP enough to never die while they are hit.
+
+    Returns:
+        dict, {operation: timings}
+    """
+    encounter = Encounter(CHARACTERS, level, SCENARIOS['worg-goblin'], Dice(seed))
+    encounter.build_encounter()
+    battle = encounter.battle
+    fighter = battle.party['fighter']
+    goblin = battle.monsters['Goblin (0)']
+    goblin.hp = float('inf')
+
+    return {
+        'roll_dice': time_it(lambda: fighter.roll_dice(1, 20), **kwargs),
+        'make_attack': time_it(lambda: fighter.make_attack(goblin, fighter.atk, 8,
+                                                            fighter.crit), **kwargs),
+        'is_dead': time_it(fighter.is_dead, **kwargs),
+        'get_target': time_it(lambda: fighter.get_target(battle.monster_pool), **kwargs)
+        }
+
+def commit():
+    # the commit the benchmarks were run on, if this is a git checkout
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(scenarios=SCENARIOS, levels=LEVELS, quick=False):
+    """
+    Runs the whole suite.
+
+    Attributes:
+        scenarios: dict, {name: antagonists} of the encounters to time
+        levels: iterable, the party levels each scenario is timed at
+        quick: boolean, runs every benchmark once for a short time, for a rough check
+
+    Returns:
+        dict, the machine the suite ran on and the results of every benchmark
+    """
+    kwargs = {'min_time': 0.05, 'repeat': 1} if quick else {}
+    results = {'combat': {}, 'build': {}}
+    for name, antagonists in scenarios.items():
+        for level in levels:
+            key = f'{name}/{level}'
+            results['combat'][key] = bench_combat(level, antagonists, **kwargs)
+            results['build'][key] = bench_build(level, antagonists, **kwargs)
+    results['micro'] = micro_benchmarks(**kwargs)
+    return {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results
+        }
+
+def compare(old, new):
+    """
+    Lines up the benchmarks two runs have in common.
+
+    Returns:
+        list, (group, benchmark, old ops/sec, new ops/sec, new / old) for each benchmark
+    """
+    rows = []
+    for group, benchmarks in new['results'].items():
+        for name, timing in benchmarks.items():
+            before = old['results'].get(group, {}).get(name)
+            if before:
+                rate, prior = timing['ops_per_sec'], before['ops_per_sec']
+                rows.append((group, name, prior, rate, rate / prior))
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the encounter simulator.')
+    parser.add_argument('--out', help='the JSON file the results are written to')
+    parser.add_argument('--quick', action='store_true', help='a short, rough run')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compares two JSON result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            old, new = json.load(f_old), json.load(f_new)
+        print(f"{old['commit']} -> {new['commit']}")
+        for group, name, prior, rate, ratio in compare(old, new):
+            print(f'{group:7s} {name:26s} {prior:12.1f} {rate:12.1f} {ratio:6.2f}x')
+        sys.exit()
+
+    report = run(quick=args.quick)
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(report, out, indent=2)
+    for group, benchmarks in report['results'].items():
+        for name, timing in benchmarks.items():
+            print(f"{group:7s} {name:26s} {timing['ops_per_sec']:12.1f}/s "
+                    f"{timing['us_per_op']:10.1f} us")
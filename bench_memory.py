@@ -0,0 +1,70 @@
+"""
+Measures how much memory and build time a PC or monster costs. Every class is built many
+times over, PCs both from scratch and from their cached template, monsters both on their
+own and as members of a squad, and tracemalloc reports what the live combatants take,
+including their ability scores, bonuses and saves, spell slots and everything else
+they own.
+
+Run with:
+    python bench_memory.py [number built per class]
+"""
+
+import sys
+import time
+import tracemalloc
+from catalog import load_catalog
+from creatures import CreatureFeature, Squad
+from handbook import Battle
+import party
+
+CLASSES = {'cleric': party.Cleric, 'fighter': party.Fighter, 'rogue': party.Rogue,
+            'wizard': party.Wizard}
+
+def measure(build, n):
+    """
+    Builds n combatants with build() and keeps them alive while they are measured.
+
+    Returns:
+        tuple, the bytes per combatant and the microseconds it took to build one
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    built = [build() for i in range(n)]
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / n, elapsed / n * 1e6
+
+def run(n=10000, level=10, creatures=('Goblin', 'Ogre', 'Adult Red Dragon')):
+    """
+    Returns:
+        dict, {combatant: (bytes each, microseconds to build)}
+    """
+    battle = Battle()
+    catalog = load_catalog()
+    results = {}
+    for name, cls in CLASSES.items():
+        def build(cls=cls):
+            pc = cls(level, battle)
+            pc.build()
+            return pc
+        results[name] = measure(build, n)
+        results[f'{name} (template)'] = measure(
+            lambda cls=cls: cls.from_template(level, battle), n)
+    for c in creatures:
+        def build(mob=catalog[c]):
+            critter = CreatureFeature(mob, 0, battle)
+            critter.build()
+            return critter
+        results[c] = measure(build, n)
+        # a squad of n is built in one go, so its cost is shared out over its members
+        squad = measure(lambda mob=catalog[c]: Squad(mob, n, battle), 1)
+        results[f'{c} (squad)'] = (squad[0] / n, squad[1] / n)
+    return results
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"{'combatant':24s} {'bytes':>8s} {'build us':>9s}")
+    for name, (used, us) in run(n).items():
+        print(f'{name:24s} {used:8.0f} {us:9.2f}')
@@ -0,0 +1,215 @@
+"""
+Caches the results of encounter queries, so a query that has been run before is answered
+without running it again.
+
+A result is stored under a hash of its query (the party, level, creatures, iterations
+and seed) together with a fingerprint of the data the results depend on: the monster
+manual in mobs.json, the rule tables of the HandBook and the PCs and RULES_VERSION.
+Editing any of them changes the fingerprint, so results from the old data are never
+returned again and are dropped from the disk the next time the cache is opened.
+
+The cache has two tiers. Recently used results are kept in memory, in a least recently
+used (LRU) list of a fixed length. Every result is also written to an SQLite file on
+disk. When the file grows past its size limit, the results used least recently are
+evicted. The times results are used are written to the disk in batches rather than on
+every hit.
+
+A query with a seed is only answered by a run of exactly that query. A query without a
+seed asks for the odds of the encounter rather than for a particular run, so it can
+also be answered by a run of the same encounter with any seed and at least as many
+iterations.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from catalog import MOBS_PATH
+from handbook import HandBook as HB
+from party import PC
+from tally import Tally
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.sqlite')
+
+# bump this whenever a change to the code changes the results of encounters, since the
+# fingerprint can only see changes to the data
+RULES_VERSION = 2
+
+def data_fingerprint(mobs_path=MOBS_PATH):
+    """
+    Hashes the data the results of an encounter depend on.
+
+    Returns:
+        str, the hex digest of mobs.json, the rule tables and RULES_VERSION
+    """
+    digest = hashlib.sha256()
+    with open(mobs_path, 'rb') as mobs:
+        digest.update(mobs.read())
+    rules = {
+        'version': RULES_VERSION,
+        'spell_book': HB.spell_book,
+        'wizard_spells': HB.wizard_spells,
+        'divine': HB.divine,
+        'cleric_spells': HB.cleric_spells,
+        'proficiency': PC.proficiency
+        }
+    digest.update(json.dumps(rules, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def encounter_key(protagonists, level, antagonists):
+    # the encounter regardless of the order it is written in, for queries without a seed
+    return json.dumps([sorted(set(p.lower() for p in protagonists)), level,
+                        sorted(antagonists.items())])
+
+class ResultCache():
+    """
+    The result cache.
+
+    Attributes:
+        path: str, the SQLite file of the disk tier
+        memory: int, the number of results kept in memory
+        max_bytes: int, the size the results on disk are evicted down to
+        fingerprint: str, the fingerprint of the data, worked out if not given
+    """
+
+    # the number of hits whose time of use is kept back before it is written to disk
+    TOUCH_BATCH = 64
+
+    def __init__(self, path=CACHE_PATH, memory=256, max_bytes=64 * 2**20,
+                    fingerprint=None):
+        self.memory = memory
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint or data_fingerprint()
+        self.recent = OrderedDict()
+        # {encounter: (iterations, key)} the biggest run of each encounter in memory, for
+        # queries without a seed
+        self.largest = {}
+        # {key: time} the uses not written to disk yet
+        self.touched = {}
+        self.hits = 0
+        self.misses = 0
+
+        # the cache may be used from a thread other than the one that opened it, such as
+        # the one the service hands its lookups to, but only from one at a time
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, '
+                        'fingerprint TEXT, encounter TEXT, iterations INTEGER, '
+                        'data TEXT, size INTEGER, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS by_encounter ON results '
+                        '(encounter, iterations)')
+        # results of data that has since changed can never be hit again
+        self.db.execute('DELETE FROM results WHERE fingerprint != ?', (self.fingerprint,))
+        self.db.commit()
+
+    def key(self, protagonists, level, antagonists, iterations, seed):
+        # the content address of a query; order matters, as it changes the rolls of a seed
+        query = [self.fingerprint, [p.lower() for p in protagonists], level,
+                    list(antagonists.items()), iterations, seed]
+        return hashlib.sha256(json.dumps(query).encode()).hexdigest()
+
+    def remember(self, key, data, encounter=None, iterations=0):
+        # puts a result at the front of the memory tier, dropping the oldest
+        self.recent[key] = data
+        self.recent.move_to_end(key)
+        while len(self.recent) > self.memory:
+            self.recent.popitem(last=False)
+        if encounter is not None:
+            best = self.largest.get(encounter)
+            if best is None or best[1] not in self.recent or best[0] <= iterations:
+                self.largest[encounter] = (iterations, key)
+
+    def touch(self, key):
+        # notes a use of a result, writing the uses to disk once enough have built up
+        self.touched[key] = time.time()
+        if len(self.touched) >= self.TOUCH_BATCH:
+            self.flush()
+
+    def flush(self):
+        # writes the times of the uses kept back to the disk
+        if self.touched:
+            self.db.executemany('UPDATE results SET used = ? WHERE key = ?',
+                                [(t, k) for k, t in self.touched.items()])
+            self.db.commit()
+            self.touched = {}
+
+    def get(self, protagonists, level, antagonists, iterations, seed=None):
+        """
+        Looks a query up, first in memory and then on disk.
+
+        Attributes:
+            protagonists, level, antagonists, iterations: the query, as for run_many()
+            seed: int, the seed of the query; None accepts a run of the encounter with any
+                seed and at least the iterations asked for
+
+        Returns:
+            Tally, the totals of the cached run, or None if there is none
+        """
+        encounter = encounter_key(protagonists, level, antagonists)
+        if seed is not None:
+            key = self.key(protagonists, level, antagonists, iterations, seed)
+        else:
+            key = self.largest.get(encounter, (0, None))[1]
+        data = self.recent.get(key)
+        if data is not None and (seed is not None or
+                                    self.largest[encounter][0] >= iterations):
+            self.recent.move_to_end(key)
+            self.hits += 1
+            self.touch(key)
+            return Tally.from_dict(json.loads(data))
+
+        if seed is not None:
+            row = self.db.execute('SELECT key, data, iterations FROM results '
+                                    'WHERE key = ?', (key,)).fetchone()
+        else:
+            row = self.db.execute('SELECT key, data, iterations FROM results '
+                                    'WHERE fingerprint = ? AND encounter = ? '
+                                    'AND iterations >= ? ORDER BY iterations DESC LIMIT 1',
+                                    (self.fingerprint, encounter, iterations)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        key, data, found = row
+        self.touch(key)
+        self.remember(key, data, encounter, found)
+        return Tally.from_dict(json.loads(data))
+
+    def put(self, protagonists, level, antagonists, iterations, seed, tally):
+        """
+        Stores the totals of a finished run in both tiers, evicting the results used least
+        recently from the disk if it has grown past max_bytes.
+        """
+        key = self.key(protagonists, level, antagonists, iterations, seed)
+        encounter = encounter_key(protagonists, level, antagonists)
+        data = json.dumps(tally.to_dict())
+        self.remember(key, data, encounter, iterations)
+        # the uses kept back count for the eviction below
+        self.flush()
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (key, self.fingerprint, encounter, iterations, data, len(data),
+                            time.time()))
+        total = self.db.execute('SELECT SUM(size) FROM results').fetchone()[0]
+        if total > self.max_bytes:
+            for old, size in self.db.execute('SELECT key, size FROM results ORDER BY used'
+                                                ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.db.execute('DELETE FROM results WHERE key = ?', (old,))
+                self.recent.pop(old, None)
+                total -= size
+        self.db.commit()
+
+    def stats(self):
+        """
+        Returns:
+            dict, the hits and misses so far and the results and bytes on disk
+        """
+        count, size = self.db.execute('SELECT COUNT(*), SUM(size) FROM results').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'memory': len(self.recent),
+                'results': count, 'bytes': size or 0}
+
+    def close(self):
+        self.flush()
+        self.db.close()
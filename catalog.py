@@ -0,0 +1,82 @@
+"""
+Loads the monster manual (mobs.json) once per process and pre-compiles every entry into
+a frozen CreatureTemplate. The stat bonuses and saving throws that CreatureFeature used
+to work out for every monster of every encounter are worked out here a single time and
+shared, read only, by all the monsters built from the template.
+"""
+
+import json
+import os
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+from handbook import HandBook as HB, Abilities, ABILITIES
+
+MOBS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mobs.json')
+
+# The keys every entry of the monster manual needs to build a monster
+REQUIRED = ('stats', 'saves', 'actions', 'ac', 'hp', 'atk', 'spell_dc', 'spell_atk',
+            'dodge', 'status')
+
+CreatureTemplate = namedtuple('CreatureTemplate', [
+    'name', 'stats', 'bonus', 'saves', 'ac', 'hp', 'atk', 'spell_dc', 'spell_atk',
+    'actions', 'attacks', 'special', 'status', 'status_save', 'status_dc', 'dodge'])
+
+def compile_creature(name, mob):
+    """
+    Validates a single entry of the monster manual and turns it into a template.
+
+    Attributes:
+        name: str, the name of the creature
+        mob: dict, the entry for the creature in mobs.json
+
+    Returns:
+        CreatureTemplate, the frozen stat block of the creature
+    """
+    missing = [k for k in REQUIRED if k not in mob]
+    if missing:
+        raise ValueError(f'{name} is missing {", ".join(missing)} in the monster manual')
+    for table in ('stats', 'saves'):
+        if any(a not in mob[table] for a in ABILITIES):
+            raise ValueError(f'{name} has an incomplete {table} table')
+
+    hb = HB()
+    bonus = {a: hb.get_bonus(mob['stats'][a]) for a in ABILITIES}
+    saves = {a: bonus[a] + mob['saves'][a] for a in ABILITIES}
+
+    return CreatureTemplate(
+        name=name,
+        stats=Abilities(**{a: mob['stats'][a] for a in ABILITIES}),
+        bonus=Abilities(**bonus),
+        saves=Abilities(**saves),
+        ac=mob['ac'],
+        hp=mob['hp'],
+        atk=mob['atk'],
+        spell_dc=mob['spell_dc'],
+        spell_atk=mob['spell_atk'],
+        actions=mob['actions']['number'],
+        attacks=MappingProxyType(dict(mob['actions']['attack'])),
+        special=MappingProxyType(dict(mob['actions']['special'])),
+        status=mob['status']['current'],
+        status_save=mob['status']['save'],
+        status_dc=mob['status']['dc'],
+        dodge=mob['dodge'] == 'True')
+
+@lru_cache(maxsize=None)
+def load_catalog(filepath=MOBS_PATH):
+    """
+    Opens the JSON file of the monsters and compiles it, only the first call for a file
+    reads it from disk. When a binary database built from the file by mobdb.py sits next
+    to it and is up to date, the database is memory mapped instead.
+
+    Returns:
+        mapping, read only {creature name: CreatureTemplate}
+    """
+    import mobdb
+    db_path = os.path.splitext(filepath)[0] + '.bin'
+    if mobdb.is_current(db_path, filepath):
+        return mobdb.MobDB(db_path)
+
+    with open(filepath) as monster_manual:
+        raw = json.load(monster_manual)
+    return MappingProxyType({k: compile_creature(k, v) for k, v in raw.items()})
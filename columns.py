@@ -0,0 +1,217 @@
+"""
+Exports the outcome of every iteration of a batch as columns of NumPy arrays, so very
+large batches can be analysed without holding a Python dict per iteration.
+
+For every iteration it records:
+
+    index: the number of the iteration in the batch, see runner.replay()
+    won: True if the party won
+    rounds: the rounds the fight took
+    killed: the number of monsters killed
+    hp_<class>: the HP each PC finished with, 0 or less if it died
+    alive_<class>: True if the PC was standing at the end
+    slots_<class>: the spell slots each caster had left
+
+A ColumnWriter keeps the outcomes in typed arrays from the array module, which cost
+about as much to append to as a list, and writes them out as a NumPy .npz part file
+whenever a chunk is full. The export is a directory of part files and a meta.json that
+describes the batch and its columns. load() reads back only the columns asked for, from
+every part, as single arrays.
+
+Note: numpy must be installed to export or load columns.
+
+Run with:
+    python columns.py [directory] [iterations]
+"""
+
+import json
+import os
+import random
+import sys
+from array import array
+from dice import Dice
+from encounter import Encounter
+from runner import iteration_seed, map_chunks
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the array typecode of each kind of column
+TYPES = {'index': 'q', 'won': 'b', 'rounds': 'H', 'killed': 'H', 'hp': 'i', 'alive': 'b',
+            'slots': 'H'}
+
+CASTERS = ('cleric', 'wizard')
+
+def column_names(protagonists):
+    """
+    Returns:
+        list, the names of the columns of an export of the party
+    """
+    names = ['index', 'won', 'rounds', 'killed']
+    classes = sorted(set(p.lower() for p in protagonists))
+    names += [f'hp_{p}' for p in classes]
+    names += [f'alive_{p}' for p in classes]
+    names += [f'slots_{p}' for p in classes if p in CASTERS]
+    return names
+
+class ColumnWriter():
+    """
+    Buffers the outcomes of iterations in columns and writes them to part files.
+
+    Attributes:
+        path: str, the directory of the export
+        protagonists: list, the character classes in the PC party
+        chunk: int, the number of iterations in each part file
+    """
+
+    def __init__(self, path, protagonists, chunk=100000):
+        if np is None:
+            raise ImportError('numpy must be installed to export columns')
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk = chunk
+        self.names = column_names(protagonists)
+        self.classes = sorted(set(p.lower() for p in protagonists))
+        self.columns = {}
+        self.reset()
+
+    def reset(self):
+        # empty columns for the next part
+        self.columns = {n: array(TYPES[n.split('_')[0]]) for n in self.names}
+
+    def add(self, index, encounter):
+        """
+        Records the outcome of an encounter once combat() has returned.
+
+        Attributes:
+            index: int, the number of the iteration in its batch
+            encounter: Encounter, the finished encounter
+        """
+        battle = encounter.battle
+        c = self.columns
+        c['index'].append(index)
+        c['won'].append(bool(battle.party and not battle.monsters))
+        c['rounds'].append(battle.round + (1 if battle.turn else 0))
+        c['killed'].append(len(battle.killed))
+        for name in self.classes:
+            pc = battle.party.get(name) or battle.dead[name]
+            c[f'hp_{name}'].append(pc.hp)
+            c[f'alive_{name}'].append(name in battle.party)
+            if name in CASTERS:
+                c[f'slots_{name}'].append(sum(pc.spell_slots))
+        if len(c['index']) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        # writes the buffered columns to a part file named after its first iteration
+        index = self.columns['index']
+        if not index:
+            return
+        arrays = {n: np.frombuffer(col, dtype=col.typecode) for n, col in
+                    self.columns.items()}
+        for n in arrays:
+            if n.startswith(('won', 'alive')):
+                arrays[n] = arrays[n].astype(bool)
+        np.savez(os.path.join(self.path, f'part-{index[0]:012d}.npz'), **arrays)
+        self.reset()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def export_chunk(protagonists, level, antagonists, seed, start, stop, path, chunk):
+    """
+    Runs the iterations numbered start to stop - 1 of a batch, seeded as runner.py seeds
+    them, and exports their outcomes to the directory path.
+
+    Returns:
+        int, the number of iterations exported
+    """
+    with ColumnWriter(path, protagonists, chunk) as writer:
+        for i in range(start, stop):
+            encounter = Encounter(protagonists, level, antagonists,
+                                    Dice(iteration_seed(seed, i)))
+            encounter.combat()
+            writer.add(i, encounter)
+    return stop - start
+
+def export_many(protagonists, level, antagonists, iterations, path, workers=None,
+                seed=None, chunk=100000):
+    """
+    Runs an encounter a number of times like runner.run_many(), exporting the outcome of
+    every iteration to the directory path instead of returning it. Every worker writes
+    its own part files, so the export never passes through a single process.
+
+    Attributes:
+        protagonists, level, antagonists, iterations, workers, seed: as for run_many()
+        path: str, the directory of the export, the parts of an earlier export in it are
+            removed
+        chunk: int, the most iterations in each part file, the iterations are
+            shared out evenly between the workers whatever it is
+
+    Returns:
+        dict, the meta data of the export, also written to meta.json
+
+    Raises:
+        ValueError, if iterations is less than one
+    """
+    if iterations < 1:
+        raise ValueError(f'an export needs at least one iteration, not {iterations}')
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # every worker gets an even share of the iterations, which it writes in parts of
+    # no more than chunk
+    share = min(chunk, -(-iterations // workers))
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.startswith('part-') and name.endswith('.npz'):
+            os.remove(os.path.join(path, name))
+    map_chunks(export_chunk, protagonists, level, antagonists, iterations, workers, seed,
+                share, path, chunk)
+    meta = {'protagonists': protagonists, 'level': level, 'antagonists': antagonists,
+            'iterations': iterations, 'seed': seed, 'columns': column_names(protagonists)}
+    with open(os.path.join(path, 'meta.json'), 'w') as out:
+        json.dump(meta, out)
+    return meta
+
+def load(path, columns=None):
+    """
+    Reads the columns of an export, only loading the ones asked for.
+
+    Attributes:
+        path: str, the directory of the export
+        columns: list, the names of the columns, all of them if not given
+
+    Returns:
+        dict, {column: numpy array} in the order of the iterations
+    """
+    if np is None:
+        raise ImportError('numpy must be installed to load columns')
+    parts = sorted(n for n in os.listdir(path) if n.startswith('part-'))
+    data = {}
+    for name in parts:
+        with np.load(os.path.join(path, name)) as part:
+            for column in columns or part.files:
+                data.setdefault(column, []).append(part[column])
+    return {column: np.concatenate(arrays) for column, arrays in data.items()}
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else 'columns'
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    characters = ['cleric', 'fighter', 'rogue', 'wizard']
+    meta = export_many(characters, 4, {'Worg': 3, 'Goblin': 7}, iterations, path)
+    results = load(path, ['won', 'rounds', 'hp_fighter'])
+    print(f"{iterations} iterations of seed {meta['seed']} exported to {path}")
+    print(f"Win rate {results['won'].mean()*100:.2f}%, "
+            f"rounds {results['rounds'].mean():.2f}, "
+            f"fighter HP on a win {results['hp_fighter'][results['won']].mean():.1f}")
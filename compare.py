@@ -0,0 +1,97 @@
+"""
+Compares variants of an encounter with a baseline, such as the party with and without
+its cleric, or a level higher, against the same mob, and reports how much each variant
+changes the win rate, with a confidence interval.
+
+The variants are run with common random numbers. Every iteration runs the baseline and
+each variant with dice.Streams of the same seed, so every combatant that takes part in
+both fights of a pair rolls the same dice in both. The two fights only drift apart as
+far as the variant makes them, and the luck they share cancels out of the difference
+in their win rates, which is measured over the pairs in a tally.PairedTally. The
+interval of the difference is then narrower than if the baseline and the variant were
+each run on their own; PairedTally.efficiency() says how many times the iterations that
+would take.
+
+A variant is given as the changes it makes to the baseline, any of:
+
+    {'protagonists': [...], 'level': 5, 'antagonists': {'Goblin': 8}}
+
+Run with:
+    python compare.py [iterations]
+"""
+
+import random
+import sys
+from dice import Streams
+from encounter import Encounter
+from runner import CHARACTERS, iteration_seed, map_chunks
+from tally import PairedTally
+
+def variant_of(protagonists, level, antagonists, changes):
+    """
+    Returns:
+        tuple, the protagonists, level and antagonists of the baseline with the changes
+            of a variant made to them
+    """
+    return (changes.get('protagonists', protagonists), changes.get('level', level),
+            changes.get('antagonists', antagonists))
+
+def compare_chunk(protagonists, level, antagonists, seed, start, stop, variants):
+    """
+    Runs the iterations numbered start to stop - 1 of a comparison in the current
+    process, each of them for the baseline and then for every variant.
+
+    Returns:
+        dict, {variant: PairedTally} of the iterations
+    """
+    encounters = {name: variant_of(protagonists, level, antagonists, changes)
+                    for name, changes in variants.items()}
+    pairs = {name: PairedTally() for name in variants}
+    for i in range(start, stop):
+        s = iteration_seed(seed, i)
+        base = bool(Encounter(protagonists, level, antagonists, Streams(s)).combat())
+        for name, (p, l, a) in encounters.items():
+            pairs[name].add(base, bool(Encounter(p, l, a, Streams(s)).combat()))
+    return pairs
+
+def compare(protagonists, level, antagonists, variants, iterations=2000, workers=None,
+            seed=None, chunk=250):
+    """
+    Runs a baseline encounter and its variants with common random numbers.
+
+    Attributes:
+        protagonists, level, antagonists: the baseline encounter, as for run_many()
+        variants: dict, {name: changes} the changes each variant makes to the baseline
+        iterations, workers, seed, chunk: as for run_many()
+
+    Returns:
+        dict, {variant: PairedTally} the paired totals of the baseline and each variant
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    totals = {name: PairedTally() for name in variants}
+    for pairs in map_chunks(compare_chunk, protagonists, level, antagonists, iterations,
+                            workers, seed, chunk, variants):
+        for name, tally in pairs.items():
+            totals[name].merge(tally)
+    for tally in totals.values():
+        tally.seed = seed
+    return totals
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    mob = {'Worg': 5, 'Goblin': 7}
+    variants = {
+        'without the rogue': {'protagonists': ['cleric', 'fighter', 'wizard']},
+        'level 5': {'level': 5},
+        'one more goblin': {'antagonists': {'Worg': 5, 'Goblin': 8}}
+        }
+    results = compare(CHARACTERS, 4, mob, variants, iterations)
+    print(f'{iterations} iterations of level 4 against {mob}')
+    print(f"{'variant':20s} {'base':>7s} {'variant':>8s} {'delta':>8s} "
+            f"{'95% interval':>18s} {'efficiency':>10s}")
+    for name, t in results.items():
+        lower, upper = t.delta_interval()
+        print(f'{name:20s} {t.base_rate()*100:6.2f}% {t.variant_rate()*100:7.2f}% '
+                f'{t.delta()*100:+7.2f}% [{lower*100:+6.2f}%, {upper*100:+6.2f}%] '
+                f'{t.efficiency():9.2f}x')
@@ -1,80 +1,96 @@
-import json
-from random import randint
-from handbook import HandBook as HB
+from array import array
+from operator import attrgetter
+from handbook import HandBook as HB, Battle
 
 class CreatureFeature(HB):
     """
-    This class is used to build the monsters for the encounter using information from the
-    monbs.json file. Each type of monster is passed to this class, which is a subclass of
-    the Handbook, and generates the appropriate number of monsters of that type. This class
-    is only called from encounter.py
+    This class is used to build the monsters for the encounter using the templates that
+    catalog.py compiles from the mobs.json file. Each type of monster is passed to this
+    class, which is a subclass of the Handbook, and generates the appropriate number of
+    monsters of that type. This class is only called from encounter.py
     """
-    def __init__(self, mob, number):
+    __slots__ = ('mob', 'number', 'battle', 'key', 'stats', 'bonus', 'saves', 'ac', 'hp',
+                'base_hp', 'status', 'status_dc', 'status_save', 'atk', 'spell_dc',
+                'spell_atk', 'actions', 'attacks', 'special', 'dodge', 'name', 'strikes',
+                'plan', 'dice')
+
+    # the plan of each creature, by name, see make_plan()
+    plans = {}
+
+    def __init__(self, mob, number, battle=None):
         self.mob = mob
         self.number = number
+        self.battle = battle if battle else Battle()
+        # the monster's key in the battle, the same one Encounter.build_monsters gives it
+        self.key = f'{mob.name} ({number})'
+        self.dice = self.battle.dice.stream(self.key)
 
     def assign_stats(self):
-        # generates the stats for the monster from the information in the JSON file
-        self.stats = self.mob['stats']
+        # takes the stats for the monster from its template in the catalog
+        self.stats = self.mob.stats
     
     def assign_name(self):
         # gives the created monster a unique identifier
         self.name = self.name + str(self.number)
     
     def assign_bonus(self):
-        # gives the monster bonuses for its stats
-        self.bonus = {
-            'int': self.get_bonus(self.stats['int']),
-            'wis': self.get_bonus(self.stats['wis']),
-            'cha': self.get_bonus(self.stats['cha']),
-            'str': self.get_bonus(self.stats['str']),
-            'dex': self.get_bonus(self.stats['dex']),
-            'con': self.get_bonus(self.stats['con']),
-        }
+        # the stat bonuses are worked out once per creature when the catalog is compiled
+        self.bonus = self.mob.bonus
     
     def assign_saves(self):
-        # generates the saveing throws for the monster
-        self.saves = {
-            'str': self.bonus['str'] + self.mob['saves']['str'],
-            'dex': self.bonus['dex'] + self.mob['saves']['dex'],
-            'con': self.bonus['con'] + self.mob['saves']['con'],
-            'int': self.bonus['int'] + self.mob['saves']['int'],
-            'wis': self.bonus['wis'] + self.mob['saves']['wis'],
-            'cha': self.bonus['cha'] + self.mob['saves']['cha']
-        }
+        # the saving throws are worked out once per creature when the catalog is compiled
+        self.saves = self.mob.saves
 
     def build(self):
         # handles the building of the monster and all the stats
         self.assign_stats()
         self.assign_bonus()
         self.assign_saves()
-        self.ac = self.mob['ac']
-        self.hp = self.mob['hp']
-        self.base_hp = self.mob['hp']
-        self.status = self.mob['status']['current']
-        self.status_dc = self.mob['status']['dc']
-        self.status_save = self.mob['status']['save']
-        self.atk = self.mob['atk']
-        self.spell_dc = self.mob['spell_dc']
-        self.spell_atk = self.mob['spell_atk']
-        self.actions = self.mob['actions']['number']
-        self.attacks = self.mob['actions']['attack'] # dict
-        self.special = self.mob['actions']['special']
-
-        if self.mob['dodge'] == 'True':
-            self.dodge = True
-        else:
-            self.dodge = False
+        self.ac = self.mob.ac
+        self.hp = self.mob.hp
+        self.base_hp = self.mob.hp
+        self.status = self.mob.status
+        self.status_dc = self.mob.status_dc
+        self.status_save = self.mob.status_save
+        self.atk = self.mob.atk
+        self.spell_dc = self.mob.spell_dc
+        self.spell_atk = self.mob.spell_atk
+        self.actions = self.mob.actions
+        self.attacks = self.mob.attacks # dict
+        self.special = self.mob.special
+        self.dodge = self.mob.dodge
+
+        # what the monster does on its turns is only worked out for its first build
+        plan = CreatureFeature.plans.get(self.mob.name)
+        if plan is None:
+            plan = CreatureFeature.plans[self.mob.name] = self.make_plan()
+        self.plan, self.strikes = plan
+
+    def make_plan(self):
+        """
+        Works out the parts of the monster's turns that only depend on its stat block.
+
+        Returns:
+            tuple, the method its turns are taken with and the damage of each attack
+        """
+        strikes = tuple(self.attacks[str(i)] for i in range(1, self.actions + 1))
+        if not self.special['name']:
+            return CreatureFeature.attack, strikes
+        elif self.special['targets'] == 'self':
+            return CreatureFeature.regenerate, strikes
+        return CreatureFeature.use_special, strikes
 
     def make_save(self, dc, stype, damage=0, status=False):
         # used to roll saving throws
         save = self.save_roll(dc, self.saves[stype])
+        if self.battle.log is not None:
+            self.battle.log.save(self, dc, stype, save, status)
         if damage and save and status:
-            self.hp -= int(damage/2) + 1
+            self.take_damage(int(damage/2) + 1)
         if damage and save and not status:
-            self.hp -= int(damage/2) + 1
+            self.take_damage(int(damage/2) + 1)
         elif damage and status and not save:
-            self.hp -= damage
+            self.take_damage(damage)
             self.status = status
             self.status_dc = dc
             self.status_save = stype
@@ -85,32 +101,202 @@ class CreatureFeature(HB):
             self.status_save = stype
 
     def take_action(self):
-        # used to choose and then take the monster's action
-        if (self.special['name'] and HB.round % self.special['cooldown'] == 0
-                and self.special['targets'] != 'self'):
+        # used to take the monster's action, as planned for its special in build()
+        self.plan(self)
+
+    def use_special(self):
+        # a special that targets the PCs, used every cooldown rounds
+        if self.battle.round % self.special['cooldown'] == 0:
+            if self.battle.log is not None:
+                self.battle.log.emit('special', self.key,
+                                        value=self.battle.log.name(self.special['name']))
             if self.special['targets'] == 'all':
-                for p in HB.party.values():
-                    p.make_save(self.special['dc'], self.special['save'], 
-                                damage=self.special['dmg'], status=self.special['effect'])
+                self.battle.save_all(self.battle.party, self.special['dc'],
+                                        self.special['save'], self.special['dmg'],
+                                        self.special['effect'])
             else:
-                t = self.get_target([p for p in HB.party.keys()])
-                target = HB.party[t]
+                t = self.get_target(self.battle.party_pool)
+                target = self.battle.party[t]
                 target.make_save(self.special['dc'], self.special['save'], 
-                                damage=self.special['dmg'], status=self.special['effect'])                       
-            self.is_dead()
-        elif (self.special['name'] and self.special['targets'] == 'self' and 
-                self.hp <= int(self.base_hp/2)):
-                if self.hp + self.special['dmg'] > self.base_hp:
-                    self.hp = self.base_hp
-                else:
-                    self.hp += self.special['dmg']
+                                damage=self.special['dmg'], status=self.special['effect'])
         else:
-            acts = 1
-            while acts < self.actions + 1 and HB.party:
-                a = self.attacks[str(acts)]
-                t = self.get_target([p for p in HB.party.keys()])
-                target = HB.party[t]
-                self.make_attack(target, self.atk, a)
-                acts += 1
-
-    
\ No newline at end of file
+            self.attack()
+
+    def regenerate(self):
+        # a special that heals the monster once it is down to half its HP
+        if self.hp <= int(self.base_hp/2):
+            before = self.hp
+            if self.hp + self.special['dmg'] > self.base_hp:
+                self.hp = self.base_hp
+            else:
+                self.hp += self.special['dmg']
+            if self.battle.log is not None:
+                self.battle.log.emit('heal', self.key, self.key, self.hp - before,
+                                        self.hp)
+        else:
+            self.attack()
+
+    def attack(self):
+        # makes each of the monster's attacks while there are PCs standing
+        for a in self.strikes:
+            if not self.battle.party:
+                break
+            t = self.get_target(self.battle.party_pool)
+            target = self.battle.party[t]
+            self.make_attack(target, self.atk, a)
+
+class Squad():
+    """
+    A squad of identical monsters, such as a horde of goblins. The squad holds the stat
+    block of the creature once, with the HP and status of each of its members in compact
+    arrays, and its members are SquadMembers that look their stats up in the squad. So a
+    horde of hundreds is built without a stat block for every monster, and an area effect
+    has every member of the squad make its save in a single pass with save_all().
+
+    Attributes:
+        mob: catalog.CreatureTemplate, the creature the squad is made of
+        size: int, the number of monsters in the squad
+        battle: Battle, the battle the squad fights in
+
+    Raises:
+        ValueError, if the squad has no members
+    """
+
+    def __init__(self, mob, size, battle=None):
+        if size < 1:
+            raise ValueError(f'a squad of {mob.name} needs at least one member, not {size}')
+        self.mob = mob
+        self.battle = battle if battle else Battle()
+
+        # the stat block every member shares
+        self.stats = mob.stats
+        self.bonus = mob.bonus
+        self.saves = mob.saves
+        self.ac = mob.ac
+        self.base_hp = mob.hp
+        self.atk = mob.atk
+        self.spell_dc = mob.spell_dc
+        self.spell_atk = mob.spell_atk
+        self.actions = mob.actions
+        self.attacks = mob.attacks
+        self.special = mob.special
+        self.dodge = mob.dodge
+
+        # the HP and status of each member, by its number
+        self.hp = array('i', [mob.hp]) * size
+        self.status = [mob.status] * size
+        self.status_dc = [mob.status_dc] * size
+        self.status_save = [mob.status_save] * size
+
+        self.members = [SquadMember(self, i) for i in range(size)]
+        plan = CreatureFeature.plans.get(mob.name)
+        if plan is None:
+            plan = CreatureFeature.plans[mob.name] = self.members[0].make_plan()
+        self.plan, self.strikes = plan
+
+    def save_all(self, members, dc, stype, damage=0, status=None):
+        """
+        Has members of the squad make the same saving throw, rolling the d20 of each in
+        turn just as their own make_save() would. Without a status or an event log the
+        saves and the damage are worked out on the HP array in one pass, and the members
+        that drop are sent to their graves at the end of it.
+
+        Attributes:
+            members: list, the living SquadMembers making the save, in order
+            dc, stype, damage, status: as for make_save()
+        """
+        battle = self.battle
+        if status or battle.log is not None:
+            # statuses and the events of each save are left to the members
+            for m in members:
+                m.make_save(dc, stype, damage, status)
+            return
+        bonus = self.saves[stype]
+        half = int(damage/2) + 1
+        hp = self.hp
+        fallen = []
+        for m in members:
+            save = m.dice.roll(1, 20)
+            # as in make_save(), only a made save takes damage when there is no status
+            if damage and (save == 20 or save + bonus >= dc):
+                hp[m.number] -= half
+                if hp[m.number] <= 0:
+                    fallen.append(m.key)
+        for key in fallen:
+            battle.fall(key)
+
+class SquadMember(HB):
+    """
+    A monster of a Squad. It takes its turns like a CreatureFeature, but only keeps its
+    number, key and dice, reading its stat block from the squad and its HP and status
+    from the squad's arrays.
+
+    Attributes:
+        squad: Squad, the squad the monster is a member of
+        number: int, the number of the monster in the squad
+    """
+    __slots__ = ('squad', 'number', 'key', 'battle', 'dice')
+
+    def __init__(self, squad, number):
+        self.squad = squad
+        self.number = number
+        self.battle = squad.battle
+        # the same key Encounter.build_monsters gives a CreatureFeature
+        self.key = f'{squad.mob.name} ({number})'
+        self.dice = self.battle.dice.stream(self.key)
+
+    mob = property(attrgetter('squad.mob'))
+    stats = property(attrgetter('squad.stats'))
+    bonus = property(attrgetter('squad.bonus'))
+    saves = property(attrgetter('squad.saves'))
+    ac = property(attrgetter('squad.ac'))
+    base_hp = property(attrgetter('squad.base_hp'))
+    atk = property(attrgetter('squad.atk'))
+    spell_dc = property(attrgetter('squad.spell_dc'))
+    spell_atk = property(attrgetter('squad.spell_atk'))
+    actions = property(attrgetter('squad.actions'))
+    attacks = property(attrgetter('squad.attacks'))
+    special = property(attrgetter('squad.special'))
+    dodge = property(attrgetter('squad.dodge'))
+    strikes = property(attrgetter('squad.strikes'))
+    plan = property(attrgetter('squad.plan'))
+
+    @property
+    def hp(self):
+        return self.squad.hp[self.number]
+
+    @hp.setter
+    def hp(self, hp):
+        self.squad.hp[self.number] = hp
+
+    @property
+    def status(self):
+        return self.squad.status[self.number]
+
+    @status.setter
+    def status(self, status):
+        self.squad.status[self.number] = status
+
+    @property
+    def status_dc(self):
+        return self.squad.status_dc[self.number]
+
+    @status_dc.setter
+    def status_dc(self, dc):
+        self.squad.status_dc[self.number] = dc
+
+    @property
+    def status_save(self):
+        return self.squad.status_save[self.number]
+
+    @status_save.setter
+    def status_save(self, stype):
+        self.squad.status_save[self.number] = stype
+
+    # the turns and saves of a squad member are those of any other monster
+    make_plan = CreatureFeature.make_plan
+    make_save = CreatureFeature.make_save
+    take_action = CreatureFeature.take_action
+    use_special = CreatureFeature.use_special
+    regenerate = CreatureFeature.regenerate
+    attack = CreatureFeature.attack
@@ -0,0 +1,136 @@
+"""
+The dice used by an encounter. Every Battle owns a Dice object that all its PCs and
+monsters roll through, so a run is reproducible from its seed and two encounters never
+share random state.
+
+Streams give every combatant its own dice, so the rolls of a combatant do not shift when
+the rest of the encounter changes. Two variants of an encounter run with Streams of the
+same seed are then rolled with common random numbers, see compare.py.
+
+BufferedDice pre-draws large blocks of results for the common dice with NumPy and then
+serves them from a cursor, which is cheaper than a call into the random module for every
+die.
+
+Note: numpy must be installed to use BufferedDice.
+"""
+
+import hashlib
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class Dice():
+    """
+    Rolls dice from a private random.Random.
+
+    Attributes:
+        seed: int, the seed of the dice, a random one is used if not given
+    """
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.uniform = self.random.random
+
+    def roll(self, n, s):
+        """
+        Rolls n dice with s sides.
+
+        Returns:
+            int, total of all dice rolled
+        """
+        u = self.uniform
+        return n + sum([int(u() * s) for num in range(n)])
+
+    def randint(self, a, b):
+        """
+        Returns:
+            int, a random number between a and b inclusive
+        """
+        return a + int(self.uniform() * (b - a + 1))
+
+    def shuffle(self, keys):
+        """
+        Shuffles the keys of the combatants into a random order, with a Fisher-Yates
+        shuffle.
+
+        Returns:
+            list, the keys shuffled in place
+        """
+        for i in range(len(keys) - 1, 0, -1):
+            j = self.randint(0, i)
+            keys[i], keys[j] = keys[j], keys[i]
+        return keys
+
+    def stream(self, key):
+        """
+        Returns:
+            Dice, the dice the combatant with the given key rolls with, these same dice
+        """
+        return self
+
+class Streams(Dice):
+    """
+    Dice that hand every combatant a stream of its own, seeded from the seed and the
+    combatant's key. The initiative order is drawn from streams of the combatants too.
+
+    Attributes:
+        seed: int, the seed of the dice, a random one is used if not given
+    """
+
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        super().__init__(seed)
+
+    def shuffle(self, keys):
+        # every combatant draws its place from a stream of its own, so the order of the
+        # others stays the same when one is added or taken away
+        draws = {key: self.stream(f'{key} (initiative)').uniform() for key in keys}
+        keys.sort(key=draws.get)
+        return keys
+
+    def stream(self, key):
+        digest = hashlib.sha256(f'{self.seed}:{key}'.encode()).digest()
+        return Dice(int.from_bytes(digest[:8], 'big'))
+
+class BufferedDice(Dice):
+    """
+    Dice that pre-draw blocks of results for the dice in sizes and serve them from a
+    cursor. Other dice and randint() fall back to the plain Dice.
+
+    Attributes:
+        seed: int, the seed of the dice, a random one is used if not given
+        block: int, the number of results drawn at a time for each kind of die
+        sizes: tuple, the sides of the dice to buffer
+    """
+
+    def __init__(self, seed=None, block=4096, sizes=(4, 6, 8, 10, 12, 20)):
+        if np is None:
+            raise ImportError('numpy must be installed to use BufferedDice')
+        super().__init__(seed)
+        self.generator = np.random.default_rng(self.random.getrandbits(64))
+        self.block = block
+        self.buffers = {s: [] for s in sizes}
+        self.cursors = {s: 0 for s in sizes}
+
+    def refill(self, s, n):
+        # keeps the unused results and tops the buffer up with a new block
+        fresh = self.generator.integers(1, s + 1, max(self.block, n)).tolist()
+        self.buffers[s] = self.buffers[s][self.cursors[s]:] + fresh
+        self.cursors[s] = 0
+
+    def roll(self, n, s):
+        if s not in self.buffers:
+            return super().roll(n, s)
+        c = self.cursors[s]
+        if c + n > len(self.buffers[s]):
+            self.refill(s, n)
+            c = 0
+        self.cursors[s] = c + n
+        if n == 1:
+            return self.buffers[s][c]
+        return sum(self.buffers[s][c:c + n])
@@ -1,7 +1,7 @@
 import json
-from random import randint
-from handbook import HandBook as HB
-import party, creatures
+from dice import Dice
+from handbook import HandBook as HB, Battle, Initiative
+import party, creatures, catalog
 
 class Encounter(HB):
     """
@@ -19,13 +19,25 @@ class Encounter(HB):
         level: an integer of the party level for the encounter
         antagonists: a dictionary of the creatures that the party will be facing using
             the format {creature1: number[, creature2: number...]}
+        dice: an optional Dice object that every roll of the encounter is made with;
+            pass Dice(seed) to make the encounter reproducible
+        profiler: an optional profiling.Profiler that instruments the encounter at every
+            call to combat() to count and time its phases
+        log: an optional events.EventLog that every event of the fight is written to
+        squads: boolean, True to build the monsters of each kind as one creatures.Squad
+            that shares a single stat block, which scales to hordes of hundreds
     """
     
-    def __init__(self, protagonists, level, antagonists):
-        """Initiates the encounter with protagonists, level, and antagonists"""
+    def __init__(self, protagonists, level, antagonists, dice=None, profiler=None,
+                    log=None, squads=False):
+        """Initiates the encounter with protagonists, level, antagonists and dice"""
         self.antagonists = antagonists
         self.level = level
         self.protagonists = protagonists
+        self.dice = dice if dice else Dice()
+        self.profiler = profiler
+        self.log = log
+        self.squads = squads
 
     def make_wizard(self):
         """
@@ -35,8 +47,7 @@ class Encounter(HB):
         Returns:
             chuck: an instance of the Wizard class
         """
-        chuck = party.Wizard(self.level)
-        chuck.build()
+        chuck = party.Wizard.from_template(self.level, self.battle)
         return chuck
 
     def make_fighter(self):
@@ -47,8 +58,7 @@ class Encounter(HB):
         Returns:
             red: an instance of the Fighter class
         """
-        red = party.Fighter(self.level)
-        red.build()
+        red = party.Fighter.from_template(self.level, self.battle)
         return red
 
     def make_cleric(self):
@@ -59,8 +69,7 @@ class Encounter(HB):
         Returns:
             matilda: an instance of the Cleric class
         """
-        matilda = party.Cleric(self.level)
-        matilda.build()
+        matilda = party.Cleric.from_template(self.level, self.battle)
         return matilda
 
     def make_rogue(self):
@@ -71,8 +80,7 @@ class Encounter(HB):
         Returns:
             blues: an instance of the Rogue class
         """
-        blues = party.Rogue(self.level)
-        blues.build()
+        blues = party.Rogue.from_template(self.level, self.battle)
         return blues
 
     def build_party(self):
@@ -92,11 +100,10 @@ class Encounter(HB):
 
     def load_creatures(self):
         """
-        Opens the JSON file of the monsters and loads it into memory.
+        Fetches the compiled monster catalog, which is only read from the JSON file of the
+        monsters the first time it is needed in the process.
         """
-        filepath = 'mobs.json'
-        with open(filepath) as monster_manual:
-            self.creature_dict = json.load(monster_manual)
+        self.creature_dict = catalog.load_catalog()
 
     def build_monsters(self):
         """
@@ -104,44 +111,57 @@ class Encounter(HB):
         """
         self.new_monsters = {}
         for a, n in self.antagonists.items():
+            if self.squads:
+                # there is no squad of none, just as there are no monsters of none below
+                if n < 1:
+                    continue
+                squad = creatures.Squad(self.creature_dict[a], n, self.battle)
+                for critter in squad.members:
+                    self.new_monsters[critter.key] = critter
+                continue
             for i in range(0, n):
                 nom = a + " (" + str(i) + ")"
-                critter = creatures.CreatureFeature(self.creature_dict[a], i)
+                critter = creatures.CreatureFeature(self.creature_dict[a], i, self.battle)
                 critter.build()
                 self.new_monsters[nom] = critter
 
     def build_initiative(self):
         """
-        Generates the initiative order for the round from PC party and monsters
+        Generates the initiative order for the round from PC party and monsters, with a
+        single shuffle of the two by the dice of the battle, see Dice.shuffle()
         """
-        base_list = []
-        final_list = []
-        for p in HB.party.keys():
-            base_list.append(p)
-        for m in HB.monsters.keys():
-            base_list.append(m)
-        while base_list:
-            final_list.append(
-                base_list.pop(
-                    randint(0,len(base_list) - 1)
-                    ))
-        return final_list
+        order = list(self.battle.party.keys()) + list(self.battle.monsters.keys())
+        return self.battle.dice.shuffle(order)
 
     def build_encounter(self):
         """
         Handles the work of loading in all the characters, monsters, and other information
-        needed to run the encounter.
+        needed to run the encounter. Every build starts a fresh Battle, so no state is
+        shared with any other encounter.
         """
+        self.battle = Battle(self.dice)
         self.load_creatures()
         self.build_party()
         self.build_monsters()
-        HB.round = 0
-        HB.turn = 0
-        HB.dead = {}
-        HB.initiative = self.build_initiative()
-        HB.injured = {}
-        HB.party = self.new_party
-        HB.monsters = self.new_monsters
+        self.battle.enlist(self.new_party, self.new_monsters)
+        self.battle.initiative = self.build_initiative()
+
+    def build_turns(self):
+        """
+        Works out the turns of the initiative order once, before the first round, as a
+        ring of the living that the dead are taken out of as they fall, so the rounds of
+        combat only visit the PCs and monsters still standing.
+
+        Returns:
+            Initiative, the ring of the turns, also kept as battle.order
+        """
+        battle = self.battle
+        actions = []
+        for key in battle.initiative:
+            side = battle.party if key in battle.party else battle.monsters
+            actions.append(side[key].take_action)
+        battle.order = Initiative(battle.initiative, actions)
+        return battle.order
 
     def combat(self):
         """
@@ -149,101 +169,70 @@ class Encounter(HB):
         the JSON file, builds the PC party an monsters, then runs each round of combat
         through the initiative order until all the PCs or all the monsters are killed.
         """
+        profiler = self.profiler
+        if profiler is not None:
+            # times the phases of this encounter alone
+            start = profiler.begin(self)
+
         self.build_encounter()
+        battle = self.battle
+        if self.log is not None:
+            battle.log = self.log
+            self.log.begin(battle)
+
+        order = self.build_turns()
+        last = len(order) - 1
+        i = 0
 
         # checks to make sure there are living PCs and Monsters before continuing
-        while HB.party and HB.monsters:
-            current = HB.initiative[HB.turn]
-
-            if current in HB.monsters.keys():
-                # starts the turn for a Monster
-                active = HB.monsters[current]
-                # checks to see if the monster can take an action
-                if active.status != 'charmed' or active.status != 'stunned':
-                    HB.monsters[current].take_action()
-                elif active.status == 'dead':
-                    active.hp = 0
-                    self.is_dead
-                # makes the saving rolls for ongoing conditions
-                elif active.status != 'normal':
-                    stype = active.status_save
-                    newsave = self.save_roll(active.status_dc, active['saves'][stype])
-                    if newsave:
-                        active.status = 'normal'
-                        active.status_dc = 0
-                        active.status_save = None
-                        HB.monsters[current].take_action()
-                    else:
-                        # makes the attack
-                        targets = [m for m in HB.monsters.keys()]
-                        if active.status == 'charmed' and len(targets) > 1:
-                            t = active.name
-                            while t == active.name:
-                                t = active.get_target(targets)
-                            target = HB.monsters[t]
-                            active.make_attack(target, active.atk, active.attacks[1])
-
-            elif current in HB.party.keys():
-                # starts the turn of a PC
-                active = HB.party[current]
-                # checks to see if the PC can take an action
-                if active.status != 'charmed' or active.status != 'stunned':
-                    HB.party[current].take_action()
-                # makes saving throws
-                elif active.status != 'normal':
-                    stype = active.status_save
-                    newsave = self.save_roll(active.status_dc, active['saves'][stype])
-                    if newsave:
-                        active.status = 'normal'
-                        active.status_dc = 0
-                        active.status_save = None
-                        HB.party[current].take_action()
-                    else:
-                        # takes the action
-                        targets = [p for p in HB.party.keys()]
-                        if active.status == 'charmed' and len(targets) > 1:
-                            t = active.name
-                            while t == active.name:
-                                t = active.get_target(targets)
-                            target = HB.party[t]
-                            active.make_attack(target, active.atk, 5)
-            
-            # checks for any newly deceased PCs or monsters
-            self.is_dead()
+        while battle.party and battle.monsters:
+            # passing over the dead at the end of the order also ends the round
+            if i < battle.turn:
+                battle.round += 1
+            battle.turn = i
+
+            if battle.log is not None:
+                battle.log.emit('turn', order.keys[i])
+            order.actions[i]()
 
             # manages the round - finished the current turn, moves on to the next entity
             # in the innitiiative order until the end of the round, the starts the next
-            if HB.turn == len(HB.initiative) - 1:
-                HB.turn = 0
-                HB.round += 1
+            if battle.turn == last:
+                battle.turn = 0
+                battle.round += 1
             else:
-                HB.turn += 1
+                battle.turn += 1
+            i = order.after(i)
         
+        if battle.log is not None:
+            battle.log.end()
+        if profiler is not None:
+            profiler.end(self, start)
+
         # handles victory conditions
-        if HB.party and not HB.monsters:
-            vic = HB.party
+        if battle.party and not battle.monsters:
+            vic = battle.party
             return {x: (vic[x].hp, vic[x].base_hp) for x in vic.keys() if vic[x].hp > 0}
 
 if __name__ == "__main__":
     # Sample version of the encounter using a 4th level party to fight wargs and goblins
-    # Note: at 10k iterations the encounter can take a couple of minutes
+    # Note: close encounters can need tens of thousands of iterations to converge
 
     with open('creature_list.json') as c_list:
         mob_list = json.load(c_list)
 
     characters = ['cleric', 'fighter', 'rogue', 'wizard']
 
-    results = []
-
     lvl = 4
     mob = {'Worg': 3, 'Goblin': 7}
-    iterator = 1000
-    for i in range(0,iterator):
-        fight = Encounter(characters, lvl, mob)
-        fight.build_encounter()
-        win = fight.combat()
-        if win:
-            results.append(win)
+    # runs until the win rate is known to +/- 0.5% at 95% confidence, or 100k iterations
+    margin = 0.005
+
+    # spreads the iterations across all CPUs and keeps running totals, see runner.py
+    from runner import tally_until
+    tally = tally_until(characters, lvl, mob, margin)
+    iterator = tally.iterations
+    low, high = tally.win_interval()
     
     spacer='--------------------------------------------------------'
     opposition = []
@@ -253,17 +242,18 @@ if __name__ == "__main__":
     outs = f'''
     Level {lvl} Party vs {opps}  ({iterator/1000}k iterations)
     {spacer}
-    Overall Win Percentage: {(len(results)/iterator)*100:6.2f}%
+    Overall Win Percentage: {tally.win_rate()*100:6.2f}%  (95% CI {low*100:.2f}-{high*100:.2f}%)
+    Rounds to Finish: {tally.mean:5.2f} (sd {tally.rounds_variance()**0.5:4.2f})
 
-    100% Survival Rate: {(len([x for x in results if len(x)==4])/iterator)*100:6.2f}%
-    75% Survival Rate: {(len([x for x in results if len(x)==3])/iterator)*100:6.2f}%
-    50% Survival Rate: {(len([x for x in results if len(x)==2])/iterator)*100:6.2f}%
-    25% Survival Rate: {(len([x for x in results if len(x)==1])/iterator)*100:6.2f}%
+    100% Survival Rate: {tally.survivor_rate(4)*100:6.2f}%
+    75% Survival Rate: {tally.survivor_rate(3)*100:6.2f}%
+    50% Survival Rate: {tally.survivor_rate(2)*100:6.2f}%
+    25% Survival Rate: {tally.survivor_rate(1)*100:6.2f}%
 
-    Cleric Survival Rate: {(len([x for x in results if 'cleric' in x.keys()])/iterator)*100:6.2f}%
-    Fighter Survival Rate: {(len([x for x in results if 'fighter' in x.keys()])/iterator)*100:6.2f}%
-    Rogue Survival Rate: {(len([x for x in results if 'rogue' in x.keys()])/iterator)*100:6.2f}%
-    Wizard Survival Rate: {(len([x for x in results if 'wizard' in x.keys()])/iterator)*100:6.2f}%
+    Cleric Survival Rate: {tally.survival_rate('cleric')*100:6.2f}%
+    Fighter Survival Rate: {tally.survival_rate('fighter')*100:6.2f}%
+    Rogue Survival Rate: {tally.survival_rate('rogue')*100:6.2f}%
+    Wizard Survival Rate: {tally.survival_rate('wizard')*100:6.2f}%
     '''
 
     print(outs)
@@ -0,0 +1,233 @@
+"""
+Writes and reads the combat event log, the record of everything that happened in a run
+of encounters: the start of every turn, attack rolls and whether they hit, missed or
+crit, saving throws, damage, healing, statuses, deaths and revivals.
+
+The log is opt-in. A Battle only emits events when its log is set, which an Encounter
+does when it is given an EventLog, so encounters run without one do no extra work but
+a check of battle.log.
+
+A log file starts with a header line of JSON describing the run, followed by fixed size
+binary records, each of them:
+
+    kind: uint8, the kind of event, see KINDS
+    fight: uint32, the number of the fight, the iteration number in a batch
+    round, turn: uint16, when in the fight it happened
+    actor, target: int16, the ids of the names of the combatants, -1 for none
+    value, extra: int32, the numbers of the event, see KINDS
+
+Names of combatants, save types and statuses are written once, the first time they
+are used, as a 'name' record followed by the UTF-8 bytes of the name, and records refer
+to them by id. Records are written through a buffer as they happen, so millions of
+fights can be logged without holding any of them in memory, and read back one at a time.
+
+Run with:
+    python events.py [log file] [iterations]     logs a batch of encounters
+    python events.py --read [log file]           counts the events of a log
+"""
+
+import json
+import struct
+import sys
+from collections import namedtuple
+from itertools import groupby
+
+MAGIC = b'DNDLOG1 '
+
+RECORD = struct.Struct('<BIHHhhii')
+
+# kind: (what value holds, what extra holds)
+KINDS = {
+    'name': ('length of the name in bytes', None),
+    'fight': ('number of combatants', None),
+    'turn': (None, None),
+    'attack': ('d20 roll', 'attack bonus'),
+    'hit': ('armor class of the target', 'critical on this roll or higher'),
+    'miss': ('armor class of the target', 'critical on this roll or higher'),
+    'crit': ('armor class of the target', 'critical on this roll or higher'),
+    'save': ('save type', 'DC'),
+    'fail': ('save type', 'DC'),
+    'damage': ('damage taken', 'HP left'),
+    'heal': ('HP healed', 'HP after'),
+    'status': ('status', 'DC'),
+    'special': ('special ability', None),
+    'death': (None, None),
+    'revive': ('HP after', None),
+    'end': ('1 if the party won', 'surviving PCs')
+    }
+
+CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# the kinds whose value is the id of a name
+NAMED_VALUES = {'save', 'fail', 'status', 'special'}
+
+Event = namedtuple('Event', 'kind fight round turn actor target value extra')
+
+class EventLog():
+    """
+    Streams the events of encounters to a file.
+
+    Attributes:
+        path: str, the log file, overwritten
+        meta: dict, anything describing the run, such as its seed, written to the header
+        first: int, the number given to the first fight logged, the next get the
+            numbers after it
+    """
+
+    def __init__(self, path, meta=None, first=0):
+        self.file = open(path, 'wb', buffering=1 << 20)
+        self.file.write(MAGIC + json.dumps(meta or {}).encode() + b'\n')
+        self.names = {}
+        self.fight = first - 1
+        self.battle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.file.close()
+
+    def name(self, name):
+        # the id of a name, writing the name to the log the first time it is seen
+        if name is None:
+            return -1
+        i = self.names.get(name)
+        if i is None:
+            i = len(self.names)
+            self.names[name] = i
+            data = str(name).encode()
+            self.file.write(RECORD.pack(CODES['name'], 0, 0, 0, i, -1, len(data), 0))
+            self.file.write(data)
+        return i
+
+    def emit(self, kind, actor=None, target=None, value=0, extra=0):
+        """
+        Writes one event of the current fight.
+
+        Attributes:
+            kind: str, one of KINDS
+            actor, target: str, the keys of the combatants, if any
+            value, extra: int, the numbers of the event
+        """
+        battle = self.battle
+        self.file.write(RECORD.pack(CODES[kind], self.fight, battle.round, battle.turn,
+                                    self.name(actor), self.name(target), value, extra))
+
+    def begin(self, battle):
+        # starts the log of a new fight
+        self.fight += 1
+        self.battle = battle
+        for key in list(battle.party) + list(battle.monsters):
+            self.name(key)
+        self.emit('fight', value=len(battle.party) + len(battle.monsters))
+
+    def end(self):
+        # ends the log of the fight
+        battle = self.battle
+        won = bool(battle.party and not battle.monsters)
+        self.emit('end', value=int(won), extra=len(battle.party) if won else 0)
+        self.battle = None
+
+    def attack(self, attacker, enemy, roll, bonus, crit):
+        # the attack roll and how it went, decided the same way as HB.make_attack
+        self.emit('attack', attacker.key, enemy.key, roll, bonus)
+        if roll >= crit:
+            kind = 'crit'
+        elif roll == 1 or roll + bonus < enemy.ac:
+            kind = 'miss'
+        else:
+            kind = 'hit'
+        self.emit(kind, attacker.key, enemy.key, enemy.ac, crit)
+
+    def save(self, entity, dc, stype, save, status=None):
+        # a saving throw and, when it is failed, the status it brings
+        self.emit('save' if save else 'fail', entity.key, None, self.name(stype), dc)
+        if status and not save:
+            self.emit('status', None, entity.key, self.name(status), dc)
+
+def read_log(path):
+    """
+    Reads a log file one event at a time.
+
+    Returns:
+        tuple, the header dict and a generator of Events, with the names of the actor
+            and target, and with the name as the value of the kinds in NAMED_VALUES
+    """
+    log = open(path, 'rb')
+    header = log.readline()
+    if not header.startswith(MAGIC):
+        log.close()
+        raise ValueError(f'{path} is not an event log')
+    meta = json.loads(header[len(MAGIC):])
+
+    def events():
+        names = {-1: None}
+        kinds = list(KINDS)
+        with log:
+            while True:
+                data = log.read(RECORD.size)
+                if len(data) < RECORD.size:
+                    # the end of the log, or a record cut short by an interruption
+                    return
+                code, fight, rnd, turn, actor, target, value, extra = RECORD.unpack(data)
+                kind = kinds[code]
+                if kind == 'name':
+                    names[actor] = log.read(value).decode()
+                    continue
+                if kind in NAMED_VALUES:
+                    value = names[value]
+                yield Event(kind, fight, rnd, turn, names[actor], names[target], value,
+                            extra)
+
+    return meta, events()
+
+def fights(events):
+    """
+    Groups the events of a log by fight.
+
+    Returns:
+        generator, (fight number, list of Events) for each fight in order
+    """
+    for fight, group in groupby(events, key=lambda e: e.fight):
+        yield fight, list(group)
+
+def log_chunk(protagonists, level, antagonists, seed, start, stop, path):
+    """
+    Runs the iterations numbered start to stop - 1 of a batch, seeded as runner.py seeds
+    them, and logs every event to path.
+
+    Returns:
+        list, the result of Encounter.combat() for each iteration in order
+    """
+    from dice import Dice
+    from encounter import Encounter
+    from runner import iteration_seed
+    meta = {'protagonists': protagonists, 'level': level, 'antagonists': antagonists,
+            'seed': seed}
+    results = []
+    with EventLog(path, meta, first=start) as log:
+        for i in range(start, stop):
+            dice = Dice(iteration_seed(seed, i))
+            results.append(Encounter(protagonists, level, antagonists, dice,
+                                        log=log).combat())
+    return results
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--read']:
+        path = sys.argv[2] if len(sys.argv) > 2 else 'events.log'
+        meta, events = read_log(path)
+        counts = {}
+        for e in events:
+            counts[e.kind] = counts.get(e.kind, 0) + 1
+        print(json.dumps(meta))
+        for kind, n in counts.items():
+            print(f'{kind:10s} {n:12d}')
+    else:
+        path = sys.argv[1] if len(sys.argv) > 1 else 'events.log'
+        iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        characters = ['cleric', 'fighter', 'rogue', 'wizard']
+        log_chunk(characters, 4, {'Worg': 3, 'Goblin': 7}, 0, 0, iterations, path)
@@ -1,4 +1,241 @@
-from random import randint
+from collections import namedtuple
+from dice import Dice
+
+ABILITIES = ('str', 'dex', 'con', 'int', 'wis', 'cha')
+
+class Abilities(namedtuple('Abilities', ABILITIES)):
+    """
+    The six ability scores, stat bonuses or saving throws of a PC or monster in a fixed
+    order. Read them as attributes, stats.dex, or by the name of the ability, saves['dex'],
+    as the name of a save comes from the monster manual and the spell tables. Holds the
+    same as a dict of the six but in a fraction of the memory.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+class Pool():
+    """
+    The keys of the living combatants on one side of a battle, kept in a list with a map
+    of where each key sits in it. Picking a random key is a single index into the list,
+    and a key is removed by moving the last key into its place, so neither has to build
+    a new list of the living.
+
+    Attributes:
+        keys: iterable, the keys to start the pool with
+    """
+
+    def __init__(self, keys=()):
+        self.keys = list(keys)
+        self.index = {k: i for i, k in enumerate(self.keys)}
+
+    def add(self, key):
+        if key not in self.index:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+
+    def remove(self, key):
+        # swaps the last key into the place of the removed one
+        i = self.index.pop(key, None)
+        if i is None:
+            return
+        last = self.keys.pop()
+        if i < len(self.keys):
+            self.keys[i] = last
+            self.index[last] = i
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        return self.keys[i]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.keys)
+
+class Initiative():
+    """
+    The initiative order of a battle as a ring of the living. Every turn of the order
+    keeps the positions of the next and the previous living turns, so the turn after any
+    other is found in one step, and a combatant is taken out of the ring when it dies
+    and put back in its place if it is revived, without the rounds ever passing over
+    the dead.
+
+    Attributes:
+        keys: list, the keys of the combatants in initiative order
+        actions: list, what each combatant does on its turn, in the same order
+    """
+
+    def __init__(self, keys, actions):
+        n = len(keys)
+        self.keys = keys
+        self.actions = actions
+        self.index = {k: i for i, k in enumerate(keys)}
+        self.next = list(range(1, n)) + [0]
+        self.prev = [n - 1] + list(range(n - 1))
+        self.live = [True] * n
+
+    def __len__(self):
+        return len(self.keys)
+
+    def remove(self, key):
+        # links the turns either side of the removed one to each other
+        i = self.index.get(key)
+        if i is None or not self.live[i]:
+            return
+        self.live[i] = False
+        self.next[self.prev[i]] = self.next[i]
+        self.prev[self.next[i]] = self.prev[i]
+
+    def restore(self, key):
+        # puts a turn back after the closest living turn before it, which is only
+        # needed when a PC is revived and so can look through the order
+        i = self.index[key]
+        if self.live[i]:
+            return
+        n = len(self.keys)
+        before = next((j % n for j in range(i - 1, i - n, -1) if self.live[j % n]), i)
+        self.live[i] = True
+        if before == i:
+            self.next[i] = self.prev[i] = i
+            return
+        after = self.next[before]
+        self.prev[i], self.next[i] = before, after
+        self.next[before] = self.prev[after] = i
+
+    def after(self, i):
+        """
+        Returns:
+            int, the position of the next living turn after position i
+        """
+        j = self.next[i]
+        # only a turn that has died since it was linked has to look further
+        while not self.live[j]:
+            j = self.next[j]
+        return j
+
+def random_target(enemies, dice):
+    """
+    The default targeting strategy: every living enemy is as likely to be picked.
+
+    Attributes:
+        enemies: Pool or list, the keys of the living enemies
+        dice: Dice, the dice of the PC or monster picking
+
+    Returns:
+        the key of the target
+    """
+    if len(enemies) == 1:
+        return enemies[0]
+    else:
+        return enemies[dice.randint(0,len(enemies) - 1)]
+
+class Battle():
+    """
+    Holds the live state of a single encounter: the PC party and their opponents, the
+    initiative order, the graves and the round and turn counters. Every combatant in the
+    encounter is given a reference to the same Battle so that several encounters can run
+    side by side in one process without sharing any state.
+
+    Attributes:
+        dice: Dice, the dice every PC and monster in the encounter rolls with
+        order: Initiative, the ring of the living in initiative order, once the fight
+            has started
+        log: events.EventLog, the log the events of the encounter are written to, None
+            unless they are being logged
+    """
+
+    def __init__(self, dice=None):
+        self.dice = dice if dice else Dice()
+        self.order = None
+        self.log = None
+
+        # Holds the PC party and their opponents and tracks initiative order for the round
+        self.monsters = {}
+        self.party = {}
+        self.initiative = []
+
+        # The keys of the living on each side, for picking targets
+        self.party_pool = Pool()
+        self.monster_pool = Pool()
+
+        # Tracks the PCs and Monsters killed in combat
+        self.dead = {}
+        self.killed = {}
+        self.injured = {}
+
+        # Tracks the round number and whose turn it is within the round
+        self.round = 0
+        self.turn = 0
+
+    def fall(self, key):
+        """
+        Moves the PC or monster with the given key out of the fight and into its grave.
+        Called the moment its HP drops to 0 or lower, so the living are always up to date
+        without looking through everyone. A fallen entity keeps its place in the
+        initiative order but is taken out of the ring of turns for as long as it is in a
+        grave.
+        """
+        if self.log is not None:
+            self.log.emit('death', target=key)
+        if self.order is not None:
+            self.order.remove(key)
+        if key in self.party:
+            self.dead[key] = self.party.pop(key)
+            self.party_pool.remove(key)
+        elif key in self.monsters:
+            self.killed[key] = self.monsters.pop(key)
+            self.monster_pool.remove(key)
+
+    def enlist(self, party, monsters):
+        """
+        Sets the PC party and the monsters of the battle.
+
+        Attributes:
+            party: dict, {key: PC}
+            monsters: dict, {key: monster}
+        """
+        self.party = party
+        self.monsters = monsters
+        self.party_pool = Pool(party)
+        self.monster_pool = Pool(monsters)
+
+    def rise(self, key):
+        # brings a dead PC back into the party
+        self.party[key] = self.dead.pop(key)
+        self.party_pool.add(key)
+        if self.order is not None:
+            self.order.restore(key)
+
+    def save_all(self, side, dc, stype, damage=0, status=None):
+        """
+        Has every living member of one side make the same saving throw, as an area effect
+        does, in the order they are in the side. The members of a Squad next to each other
+        in the side make theirs together, with Squad.save_all().
+
+        Attributes:
+            side: dict, the party or the monsters
+            dc, stype, damage, status: as for make_save()
+        """
+        # the saves can kill, which takes the fallen out of the side
+        run = []
+        for v in list(side.values()):
+            squad = getattr(v, 'squad', None)
+            if run and squad is not run[0].squad:
+                run[0].squad.save_all(run, dc, stype, damage, status)
+                run = []
+            if squad is None:
+                v.make_save(dc, stype, damage, status)
+            else:
+                run.append(v)
+        if run:
+            run[0].squad.save_all(run, dc, stype, damage, status)
 
 class HandBook():
     """
@@ -9,18 +246,20 @@ class HandBook():
     Note: the random module must be installed for this program to work.
     """
 
-    # Holds the PC party and their opponents and tracks initiative order for the round
-    monsters = {}
-    party = {}
-    initiative = []
+    # The PCs and monsters built on the HandBook keep their attributes in __slots__
+    __slots__ = ()
+
+    # The live state of the encounter the PC or monster is taking part in, set when the
+    # entity is built for an encounter
+    battle = None
 
-    # Tracks the PCs and Monsters killed in combat
-    dead = {}
-    killed = {}
+    # The dice the PC or monster rolls with, the dice of its battle unless they are
+    # Streams that give it its own, see Dice.stream()
+    dice = None
 
-    # Tracks the round number and whose turn it is within the round
-    round = 0
-    turn = 0
+    # Picks the target of a single target action from a Pool of the living enemies,
+    # called with the pool and the dice of the PC or monster picking
+    targeting = staticmethod(random_target)
 
     # A list where the wizard level is the index for the spellboox list which sets the
     # number of spells a wizard has of each level
@@ -114,7 +353,7 @@ class HandBook():
         Returns:
             int, total of all dice rolled
         """
-        return sum([randint(1,s) for num in range(1,n+1)])
+        return self.dice.roll(n, s)
 
     def save_roll(self, dc, bonus):
         """
@@ -166,50 +405,65 @@ class HandBook():
         elif stat > 19:
             return 5
 
+    def take_damage(self, damage):
+        """
+        Takes damage off the HP of the PC or monster and sends it to its grave straight
+        away if that kills it.
+
+        Attributes:
+            damage: int, the damage taken
+
+        Returns:
+            boolean, True if the damage dropped the HP to 0 or lower
+        """
+        self.hp -= damage
+        if self.battle.log is not None:
+            self.battle.log.emit('damage', target=self.key, value=damage, extra=self.hp)
+        if self.hp <= 0:
+            self.battle.fall(self.key)
+            return True
+        return False
+
     def is_dead(self):
         """
-        Goes through all PCs and Monsters after every action and round to check if there
-        are any entities with HP at or lower than 0, then moves them into the correct
-        grave list and takes them out of the innitiative order.
+        Goes through all PCs and Monsters to check if there are any entities with HP at or
+        lower than 0, then moves them into the correct grave list. Damage taken through
+        take_damage() already does this as it happens, so this full sweep is only needed
+        after HP has been changed directly.
         """
-        mgrave = []
-        pgrave = []
+        battle = self.battle
+        grave = []
 
-        if HandBook.monsters:
-            for k,v in HandBook.monsters.items():
+        if battle.monsters:
+            for k,v in battle.monsters.items():
                 if v.hp <= 0:
-                    HandBook.killed[k] = v
-                    mgrave.append(k)
+                    grave.append(k)
         
-        if HandBook.party:
-            for k,v in HandBook.party.items():
+        if battle.party:
+            for k,v in battle.party.items():
                 if v.hp <= 0:
-                    HandBook.dead[k] = v
-                    pgrave.append(k)
+                    grave.append(k)
         
-        if mgrave:
-            for m in mgrave:
-                del HandBook.monsters[m]
-        
-        if pgrave:
-            for p in pgrave:
-                del HandBook.party[p]
+        for k in grave:
+            battle.fall(k)
 
     def get_target(self, enemies):
         """
-        Uses randome number to pick a target for the action (spell or attack) to be used
-        by the PC or monster when using single target actions.
+        Uses the targeting strategy and the dice of the entity to pick a target for the
+        action (spell or attack) to be used by the PC or monster when using single target
+        actions.
+
+        Attributes:
+            enemies: Pool or list, the keys of the living enemies, usually
+                battle.monster_pool or battle.party_pool
         """
-        if len(enemies) == 1:
-            return enemies[0]
-        else:
-            return enemies[randint(0,len(enemies) - 1)]
+        return self.targeting(enemies, self.dice)
 
     def make_attack(self, enemy, bonus, damage, crit=20, extra=0):
         """
         Takes a target, makes an attack roll vs the target's armor class, and then applies
-        damage to the target's HP on a successfull attack. At the end of the attack, checks
-        if any targets are now dead.
+        damage to the target's HP on a successfull attack, which sends the target to its
+        grave if it kills it.
 
         Attributes:
             enemy: dict, the target of the attack
@@ -218,17 +472,17 @@ class HandBook():
             crit: int, the number that if rolled deals critical damage
         """
         attack = self.roll_dice(1,20)
+        if self.battle.log is not None:
+            self.battle.log.attack(self, enemy, attack, bonus, crit)
         if attack >= crit:
             if not enemy.dodge:
-                enemy.hp -= damage + bonus + extra
+                enemy.take_damage(damage + bonus + extra)
             else:
-                enemy.hp -= int((damage + bonus + extra)/2) + 1
+                enemy.take_damage(int((damage + bonus + extra)/2) + 1)
         elif attack == 1:
             enemy.hp -= 0
         elif attack + bonus >= enemy.ac:
             if not enemy.dodge:
-                enemy.hp -= damage + bonus + extra
+                enemy.take_damage(damage + bonus + extra)
             else:
-                enemy.hp -= int((damage + bonus + extra)/2) + 1
-
-        self.is_dead()
+                enemy.take_damage(int((damage + bonus + extra)/2) + 1)
@@ -0,0 +1,264 @@
+"""
+Compiles the monster manual (mobs.json) and the creature list (creature_list.json) into
+a fixed layout binary file that the simulator memory maps instead of decoding JSON. All
+processes that open the file share one copy of it in the page cache, and a creature is
+found by name through a hash index stored in the file itself.
+
+Build the file with:
+    python mobdb.py [mobs.json] [creature_list.json] [mobs.bin]
+
+Layout (little endian):
+    header    magic, version, record size, record count and the offsets of the sections
+    records   one fixed size RECORD per creature
+    index     open addressing hash table of record number + 1 (0 is an empty slot)
+    strings   every name and text field as a 2 byte length followed by utf-8 bytes
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from collections.abc import Mapping
+from types import MappingProxyType
+from catalog import ABILITIES, CreatureTemplate, compile_creature, MOBS_PATH
+from handbook import Abilities
+
+DB_PATH = os.path.splitext(MOBS_PATH)[0] + '.bin'
+LIST_PATH = os.path.join(os.path.dirname(MOBS_PATH), 'creature_list.json')
+
+MAGIC = b'DNDMOBDB'
+VERSION = 1
+MAX_ATTACKS = 8
+
+# magic, version, record size, count, records offset, index slots, index offset,
+# strings offset
+HEADER = struct.Struct('<8sHHIIIII')
+
+# name, stats, bonus, saves, ac, hp, atk, spell_dc, spell_atk, actions, number of
+# attacks, attacks, special name, targets, save, cooldown, dc, dmg, effect, status,
+# status save, status dc, dodge, listed in creature_list.json
+RECORD = struct.Struct(f'<I6b6b6bHHbbbBB{MAX_ATTACKS}HIIIHHHIIIH??')
+
+# String offsets that stand in for the non string values found in the JSON
+NONE = 0xFFFFFFFF
+FALSE = 0xFFFFFFFE
+
+def name_hash(name):
+    # stable across processes, unlike the built in hash() of a string
+    return zlib.crc32(name.encode('utf-8'))
+
+class StringTable():
+    """
+    Collects the strings of the database while it is built, storing each one once.
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, value):
+        if value is None:
+            return NONE
+        if value is False:
+            return FALSE
+        if value not in self.offsets:
+            raw = str(value).encode('utf-8')
+            self.offsets[value] = len(self.data)
+            self.data += struct.pack('<H', len(raw)) + raw
+        return self.offsets[value]
+
+def pack_creature(template, strings, listed):
+    """
+    Packs a CreatureTemplate into a fixed size record.
+
+    Returns:
+        bytes, the record for the creature
+    """
+    attacks = [template.attacks[str(i)] for i in range(1, len(template.attacks) + 1)]
+    if len(attacks) > MAX_ATTACKS:
+        raise ValueError(f'{template.name} has more than {MAX_ATTACKS} attacks')
+    special = template.special
+    return RECORD.pack(
+        strings.add(template.name),
+        *[template.stats[a] for a in ABILITIES],
+        *[template.bonus[a] for a in ABILITIES],
+        *[template.saves[a] for a in ABILITIES],
+        template.ac, template.hp, template.atk, template.spell_dc, template.spell_atk,
+        template.actions, len(attacks), *(attacks + [0] * (MAX_ATTACKS - len(attacks))),
+        strings.add(special['name']), strings.add(special['targets']),
+        strings.add(special['save']), special['cooldown'], special['dc'],
+        special['dmg'], strings.add(special['effect']),
+        strings.add(template.status), strings.add(template.status_save),
+        template.status_dc, template.dodge, listed)
+
+def compile_db(mobs_path=MOBS_PATH, list_path=LIST_PATH, db_path=DB_PATH):
+    """
+    The build step: compiles the JSON files into the binary database.
+
+    Attributes:
+        mobs_path: str, the monster manual
+        list_path: str, the list of creatures available to the simulator
+        db_path: str, where to write the database
+
+    Returns:
+        list, the names in the creature list that are not in the monster manual
+    """
+    with open(mobs_path) as monster_manual:
+        raw = json.load(monster_manual)
+    with open(list_path) as c_list:
+        listed = set(json.load(c_list))
+
+    names = list(raw.keys())
+    strings = StringTable()
+    records = b''.join(pack_creature(compile_creature(n, raw[n]), strings, n in listed)
+                        for n in names)
+
+    slots = 1
+    while slots < 2 * len(names):
+        slots *= 2
+    index = [0] * slots
+    for i, n in enumerate(names):
+        h = name_hash(n) & (slots - 1)
+        while index[h]:
+            h = (h + 1) & (slots - 1)
+        index[h] = i + 1
+
+    records_at = HEADER.size
+    index_at = records_at + len(records)
+    strings_at = index_at + 4 * slots
+    header = HEADER.pack(MAGIC, VERSION, RECORD.size, len(names), records_at, slots,
+                            index_at, strings_at)
+
+    # writes to a temporary file first so a running simulator never maps half a file
+    tmp_path = db_path + '.tmp'
+    with open(tmp_path, 'wb') as db:
+        db.write(header)
+        db.write(records)
+        db.write(struct.pack(f'<{slots}I', *index))
+        db.write(strings.data)
+    os.replace(tmp_path, db_path)
+
+    return sorted(listed - set(names))
+
+def is_current(db_path, *sources):
+    """
+    Checks that the database exists and was built after every one of its source files.
+    """
+    if not os.path.exists(db_path):
+        return False
+    built = os.path.getmtime(db_path)
+    return all(os.path.getmtime(s) <= built for s in sources if os.path.exists(s))
+
+class MobDB(Mapping):
+    """
+    Read only view of a compiled monster database. Behaves like the dict returned by
+    catalog.load_catalog(), {creature name: CreatureTemplate}, but looks creatures up in
+    the memory mapped file instead of holding them all in memory. A creature is only
+    unpacked the first time it is asked for; the read only template is kept and shared
+    by every lookup after that, so only the creatures a process fights cost it memory.
+    """
+    def __init__(self, db_path=DB_PATH):
+        with open(db_path, 'rb') as db:
+            self.buffer = mmap.mmap(db.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, size, self.count, self.records_at, self.slots, self.index_at,
+            self.strings_at) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION or size != RECORD.size:
+            raise ValueError(f'{db_path} is not a version {VERSION} monster database')
+        self.templates = {}
+
+    def get_string(self, offset):
+        if offset == NONE:
+            return None
+        if offset == FALSE:
+            return False
+        at = self.strings_at + offset
+        length = struct.unpack_from('<H', self.buffer, at)[0]
+        return self.buffer[at + 2:at + 2 + length].decode('utf-8')
+
+    def get_record(self, i):
+        return RECORD.unpack_from(self.buffer, self.records_at + i * RECORD.size)
+
+    def find(self, name):
+        """
+        Looks a creature up in the hash index.
+
+        Returns:
+            int, the record number of the creature or -1 if it is not in the database
+        """
+        h = name_hash(name) & (self.slots - 1)
+        while True:
+            slot = struct.unpack_from('<I', self.buffer, self.index_at + 4 * h)[0]
+            if not slot:
+                return -1
+            if self.get_string(self.get_record(slot - 1)[0]) == name:
+                return slot - 1
+            h = (h + 1) & (self.slots - 1)
+
+    def unpack(self, i):
+        """
+        Turns the record number i back into a CreatureTemplate.
+        """
+        r = self.get_record(i)
+        n_attacks = r[25]
+        (sp_name, sp_targets, sp_save, sp_cooldown, sp_dc, sp_dmg, sp_effect, status,
+            status_save, status_dc, dodge) = r[26 + MAX_ATTACKS:37 + MAX_ATTACKS]
+        return CreatureTemplate(
+            name=self.get_string(r[0]),
+            stats=Abilities(*r[1:7]),
+            bonus=Abilities(*r[7:13]),
+            saves=Abilities(*r[13:19]),
+            ac=r[19],
+            hp=r[20],
+            atk=r[21],
+            spell_dc=r[22],
+            spell_atk=r[23],
+            actions=r[24],
+            attacks=MappingProxyType(
+                {str(a + 1): r[26 + a] for a in range(n_attacks)}),
+            special=MappingProxyType({
+                'name': self.get_string(sp_name),
+                'targets': self.get_string(sp_targets),
+                'cooldown': sp_cooldown,
+                'dc': sp_dc,
+                'save': self.get_string(sp_save),
+                'effect': self.get_string(sp_effect),
+                'dmg': sp_dmg}),
+            status=self.get_string(status),
+            status_save=self.get_string(status_save),
+            status_dc=status_dc,
+            dodge=dodge)
+
+    def listed(self):
+        """
+        Returns:
+            list, the creatures from creature_list.json found in the database
+        """
+        return [self.get_string(self.get_record(i)[0]) for i in range(self.count)
+                if self.get_record(i)[-1]]
+
+    def __getitem__(self, name):
+        template = self.templates.get(name)
+        if template is None:
+            i = self.find(name)
+            if i < 0:
+                raise KeyError(name)
+            template = self.templates[name] = self.unpack(i)
+        return template
+
+    def __contains__(self, name):
+        return name in self.templates or self.find(name) >= 0
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.get_string(self.get_record(i)[0])
+
+    def __len__(self):
+        return self.count
+
+if __name__ == "__main__":
+    paths = sys.argv[1:4]
+    missing = compile_db(*paths)
+    print(f'Wrote {paths[2] if len(paths) > 2 else DB_PATH}')
+    for m in missing:
+        print(f'Warning: {m} is in the creature list but not the monster manual')
@@ -1,17 +1,40 @@
 from copy import deepcopy
-from handbook import HandBook as HB
+from handbook import HandBook as HB, Abilities, Battle
 
 class PC():
     """
     Provides the basic building blocks of the Player Characters (PC) for the party. Every
     class has their unique skills, which is why 
+
+    The PCs are built in their millions over a sweep, so they keep their attributes in
+    __slots__ instead of a __dict__ and their ability scores, bonuses and saves in
+    Abilities tuples instead of dicts.
+
+    The choices of a PC's turn that only depend on its class and level are made once, in
+    prepare(), which picks the method its turn is played with and keeps it in plan, so
+    take_action() only decides what depends on the state of the battle.
     """
-    def __init__(self, level):
+    __slots__ = ('level', 'battle', 'base_stats', 'pro', 'stats', 'bonus', 'saves', 'name',
+                'status', 'stats_save', 'status_dc', 'status_save', 'actions', 'hp',
+                'base_hp', 'ac', 'atk', 'dodge', 'plan', 'dice')
+
+    # the proficiency bonus gained at each level, the same for every PC
+    proficiency = (2,0,0,0,1,0,0,0,1,0,0,0,1,0,0,0,1,0,0,0)
+
+    # the prepared attributes of each (class, level) built with from_template()
+    templates = {}
+
+    def __init__(self, level, battle=None):
         self.level = level
+        self.battle = battle if battle else Battle()
         self.base_stats = [17, 14, 14, 12, 12, 9]
-        self.proficiency = [2,0,0,0,1,0,0,0,1,0,0,0,1,0,0,0,1,0,0,0]
         self.pro = sum(self.proficiency[0:self.level+1])
 
+    @property
+    def key(self):
+        # the PC's key in the party is the name of its class
+        return self.name
+
     def adjust_stats(self):
         # At certain level points characters gain bonuses to their stats
         if self.level >= 17:
@@ -28,65 +51,91 @@ class PC():
         elif self.level < 8 and self.level >= 4:
             self.base_stats[0] += 2
 
+    def assign_bonus(self):
+        # creates the stats bonuses
+        self.bonus = Abilities(*[self.get_bonus(stat) for stat in self.stats])
+
+    def build(self):
+        # builds the PC from scratch: everything its class and level decide, then its dice
+        self.prepare()
+        self.dice = self.battle.dice.stream(f'{self.key} (build)')
+        self.roll()
+        self.dice = self.battle.dice.stream(self.key)
+
+    @classmethod
+    def from_template(cls, level, battle=None):
+        """
+        Builds a PC of the class and level by copying a prepared template of it and
+        rolling only its dice, instead of working out its stats, saves and features again
+        for every encounter. The templates are made the first time a class and level are
+        asked for and kept in PC.templates.
+
+        Returns:
+            PC, ready for battle, the same as one made with build()
+        """
+        template = PC.templates.get((cls, level))
+        if template is None:
+            pc = cls(level)
+            pc.prepare()
+            slots = [name for c in cls.__mro__ for name in getattr(c, '__slots__', ())]
+            template = [(name, getattr(pc, name)) for name in slots
+                        if name not in ('battle', 'dice') and hasattr(pc, name)]
+            PC.templates[(cls, level)] = template
+        pc = cls.__new__(cls)
+        for name, value in template:
+            setattr(pc, name, value)
+        pc.battle = battle if battle else Battle()
+        pc.dice = pc.battle.dice.stream(f'{pc.key} (build)')
+        pc.roll()
+        pc.dice = pc.battle.dice.stream(pc.key)
+        return pc
+
 class Wizard(PC, HB):
     """
     The class for building wizards. The only function of note here is cast_spell, which
     handles the rules for casting spells by the PC.
     """
+    __slots__ = ('spell_atk', 'dc', 'spell_slots')
 
     def assign_stats(self):
         # generates the PC stats based on the template
-        self.stats = {
-            'int': self.base_stats[0],
-            'wis': self.base_stats[1],
-            'con': self.base_stats[2],
-            'cha': self.base_stats[3],
-            'dex': self.base_stats[4],
-            'str': self.base_stats[5]
-        }
-    
-    def assign_bonus(self):
-        # creates the stats bonuses
-        self.bonus = {
-            'int': self.get_bonus(self.stats['int']),
-            'wis': self.get_bonus(self.stats['wis']),
-            'cha': self.get_bonus(self.stats['cha']),
-            'str': self.get_bonus(self.stats['str']),
-            'dex': self.get_bonus(self.stats['dex']),
-            'con': self.get_bonus(self.stats['con']),
-        }
+        self.stats = Abilities(
+            int=self.base_stats[0],
+            wis=self.base_stats[1],
+            con=self.base_stats[2],
+            cha=self.base_stats[3],
+            dex=self.base_stats[4],
+            str=self.base_stats[5]
+        )
     
     def assign_saves(self):
         # creates the saving throws
-        self.saves = {
-            'str': self.bonus['str'],
-            'dex': self.bonus['dex'],
-            'con': self.bonus['con'],
-            'int': self.bonus['int'],
-            'wis': self.bonus['wis'],
-            'cha': self.bonus['cha']
-        }
-
-    def build(self):
-        # builds the wizard PC
+        self.saves = Abilities(
+            str=self.bonus.str,
+            dex=self.bonus.dex,
+            con=self.bonus.con,
+            int=self.bonus.int,
+            wis=self.bonus.wis,
+            cha=self.bonus.cha
+        )
+
+    def prepare(self):
+        # works out everything about the wizard PC that does not need the dice
         self.adjust_stats()
         self.assign_stats()
         self.assign_bonus()
         self.assign_saves()
-        self.saves['int'] += self.pro
-        self.saves['wis'] += self.pro
+        self.saves = self.saves._replace(int=self.saves.int + self.pro,
+                                            wis=self.saves.wis + self.pro)
         self.name = 'wizard'
         self.status = 'normal'
         self.stats_save = None
         self.status_dc = 0
         self.actions = 1
-        self.hp = 6 + self.bonus['con'] 
-        self.hp += self.roll_dice(self.level,6) + self.level * self.bonus['con']
-        self.base_hp = self.hp
-        self.spell_atk = self.pro + self.bonus['int']
+        self.spell_atk = self.pro + self.bonus.int
         self.dc = 8 + self.spell_atk
-        self.ac = 17 + self.bonus['dex']
-        self.atk = self.pro + self.bonus['str']
+        self.ac = 17 + self.bonus.dex
+        self.atk = self.pro + self.bonus.str
         self.dodge = False
 
         self.spell_slots = deepcopy(self.spell_book[self.level])
@@ -98,16 +147,28 @@ class Wizard(PC, HB):
         elif self.level >= 18:
             self.spell_slots[0] += 1
             self.spell_slots[1] += 1
+
+        # what the wizard does once its spell slots are spent
+        self.plan = Wizard.cast_disintegrate if self.level >= 13 else Wizard.cast_cantrip
+
+    def roll(self):
+        # rolls the wizard's HP and gives it its own spell slots to spend
+        self.hp = 6 + self.bonus.con 
+        self.hp += self.roll_dice(self.level,6) + self.level * self.bonus.con
+        self.base_hp = self.hp
+        self.spell_slots = list(self.spell_slots)
     
     def make_save(self, dc, stype, damage=0, status=None):
         # handles the saving throws
         save = self.save_roll(dc, self.saves[stype])
+        if self.battle.log is not None:
+            self.battle.log.save(self, dc, stype, save, status)
         if damage and save and status:
-            self.hp -= int(damage/2) + 1
+            self.take_damage(int(damage/2) + 1)
         if damage and save and not status:
-            self.hp -= int(damage/2) + 1
+            self.take_damage(int(damage/2) + 1)
         elif damage and status and not save:
-            self.hp -= damage
+            self.take_damage(damage)
             self.status = status
             self.status_dc = dc
             self.status_save = stype
@@ -121,15 +182,13 @@ class Wizard(PC, HB):
         # chooses spells and handles the casting mechanics
         wiz = HB.wizard_spells
         spell_level = len(self.spell_slots) - 1
-        if len(HB.monsters) > 2 and spell_level > 2:
+        if len(self.battle.monsters) > 2 and spell_level > 2:
             spell = wiz['all'][spell_level]
             dmg = spell['dmg'] + self.spell_atk
-            for v in HB.monsters.values():
-                v.make_save(self.dc, spell['save'], dmg)
-            self.is_dead()
+            self.battle.save_all(self.battle.monsters, self.dc, spell['save'], dmg)
         else:
-            t = self.get_target([m for m in HB.monsters.keys()])
-            target = HB.monsters[t]
+            t = self.get_target(self.battle.monster_pool)
+            target = self.battle.monsters[t]
             spell = wiz['one'][spell_level]
             dmg = wiz['one'][spell_level]['dmg'] + self.spell_atk
             if spell['type'] == 'attack':
@@ -137,7 +196,6 @@ class Wizard(PC, HB):
             else:
                 s_throw = wiz['one'][spell_level]['save']
                 target.make_save(self.dc, s_throw, dmg)
-                self.is_dead()
         
         if self.spell_slots[-1] == 1:
             self.spell_slots.pop()
@@ -147,56 +205,52 @@ class Wizard(PC, HB):
     def take_action(self):
         if self.spell_slots:
             self.cast_spell()
-        elif self.level >= 13:
-            dmg = 30 + self.spell_atk + self.roll_dice(7,8)
-            t = self.get_target([m for m in HB.monsters.keys()])
-            target = HB.monsters[t]
-            target.make_save(self.dc, 'con', damage=dmg)
         else:
-            t = self.get_target([m for m in HB.monsters.keys()])
-            target = HB.monsters[t]
-            self.make_attack(target, self.atk, self.roll_dice(1,8))
+            self.plan(self)
+
+    def cast_disintegrate(self):
+        # from level 13 the wizard has a spell to fall back on that needs no slots
+        dmg = 30 + self.spell_atk + self.roll_dice(7,8)
+        t = self.get_target(self.battle.monster_pool)
+        target = self.battle.monsters[t]
+        target.make_save(self.dc, 'con', damage=dmg)
+
+    def cast_cantrip(self):
+        # below level 13 the wizard falls back on an attack
+        t = self.get_target(self.battle.monster_pool)
+        target = self.battle.monsters[t]
+        self.make_attack(target, self.atk, self.roll_dice(1,8))
 
 class Fighter(PC, HB):
     """
     Builds the fighter PC and handles their actions
     """
+    __slots__ = ('crit', 'reroll', 'surge', 'heal')
 
     def assign_stats(self):
         # generates the PC stats based on the template
-        self.stats = {
-            'int': self.base_stats[5],
-            'wis': self.base_stats[4],
-            'con': self.base_stats[1],
-            'cha': self.base_stats[3],
-            'dex': self.base_stats[2],
-            'str': self.base_stats[0]
-        }
-    
-    def assign_bonus(self):
-        # creates the stats bonuses
-        self.bonus = {
-            'int': self.get_bonus(self.stats['int']),
-            'wis': self.get_bonus(self.stats['wis']),
-            'cha': self.get_bonus(self.stats['cha']),
-            'str': self.get_bonus(self.stats['str']),
-            'dex': self.get_bonus(self.stats['dex']),
-            'con': self.get_bonus(self.stats['con']),
-        }
+        self.stats = Abilities(
+            int=self.base_stats[5],
+            wis=self.base_stats[4],
+            con=self.base_stats[1],
+            cha=self.base_stats[3],
+            dex=self.base_stats[2],
+            str=self.base_stats[0]
+        )
     
     def assign_saves(self):
         # creates the saving throws
-        self.saves = {
-            'str': self.bonus['str'] + self.pro,
-            'dex': self.bonus['dex'],
-            'con': self.bonus['con'] + self.pro,
-            'int': self.bonus['int'],
-            'wis': self.bonus['wis'],
-            'cha': self.bonus['cha']
-        }
-
-    def build(self):
-        # handles the building of the fighter character
+        self.saves = Abilities(
+            str=self.bonus.str + self.pro,
+            dex=self.bonus.dex,
+            con=self.bonus.con + self.pro,
+            int=self.bonus.int,
+            wis=self.bonus.wis,
+            cha=self.bonus.cha
+        )
+
+    def prepare(self):
+        # handles the building of the fighter character, all but the dice
         self.adjust_stats()
         self.assign_stats()
         self.assign_bonus()
@@ -206,11 +260,8 @@ class Fighter(PC, HB):
         self.stats_save = None
         self.status_dc = 0
         self.actions = 1
-        self.hp = 8 + self.bonus['con'] 
-        self.hp += self.roll_dice(self.level,8) + self.level * self.bonus['con']
-        self.base_hp = self.hp
-        self.ac = 14 + self.bonus['dex'] + 2 + 1
-        self.atk = self.pro + self.bonus['str']
+        self.ac = 14 + self.bonus.dex + 2 + 1
+        self.atk = self.pro + self.bonus.str
         self.crit = 20
         self.reroll = 0
         self.surge = 0
@@ -218,50 +269,49 @@ class Fighter(PC, HB):
         self.dodge = False
 
         if self.level == 20:
-            self.ac = 18 + self.bonus['dex'] + 2 + 2
+            self.ac = 18 + self.bonus.dex + 2 + 2
             self.surge = 2
             self.actions += 3
-            self.heal = self.roll_dice(1,10) + self.level
             self.reroll = 3
             self.crit = 18
         elif self.level >= 17:
-            self.ac = 18 + self.bonus['dex'] + 2 + 2
+            self.ac = 18 + self.bonus.dex + 2 + 2
             self.reroll = 3
             self.actions += 2
             self.surge = 1
             self.crit = 18
         elif self.level >= 15:
-            self.ac = 18 + self.bonus['dex'] + 2 + 2
+            self.ac = 18 + self.bonus.dex + 2 + 2
             self.reroll = 2
             self.actions += 2
             self.surge = 1
             self.crit = 18
         elif self.level >= 13:
-            self.ac = 17 + self.bonus['dex'] + 2 + 2
+            self.ac = 17 + self.bonus.dex + 2 + 2
             self.reroll = 2
             self.actions += 2
             self.surge = 1
             self.crit = 19
         elif self.level >= 11:
-            self.ac = 17 + self.bonus['dex'] + 2 + 2
+            self.ac = 17 + self.bonus.dex + 2 + 2
             self.reroll = 1
             self.actions += 2
             self.surge = 1
             self.crit = 19
         elif self.level >= 10:
-            self.ac = 17 + self.bonus['dex'] + 2 + 2
+            self.ac = 17 + self.bonus.dex + 2 + 2
             self.reroll = 1
             self.actions += 1
             self.surge = 1
             self.crit = 19
         elif self.level >= 9:
-            self.ac = 16 + self.bonus['dex'] + 2 + 1
+            self.ac = 16 + self.bonus.dex + 2 + 1
             self.reroll = 1
             self.actions += 1
             self.surge = 1
             self.crit = 19
         elif self.level >= 5:
-            self.ac = 16 + self.bonus['dex'] + 2 + 1
+            self.ac = 16 + self.bonus.dex + 2 + 1
             self.actions += 1
             self.surge = 1
             self.crit = 19
@@ -271,6 +321,16 @@ class Fighter(PC, HB):
         elif self.level >= 2:
             self.surge = 1
 
+        self.plan = Fighter.rally if self.level >= 18 else Fighter.fight
+
+    def roll(self):
+        # rolls the fighter's HP and, at level 20, its second wind
+        self.hp = 8 + self.bonus.con 
+        self.hp += self.roll_dice(self.level,8) + self.level * self.bonus.con
+        self.base_hp = self.hp
+        if self.level == 20:
+            self.heal = self.roll_dice(1,10) + self.level
+
     def make_save(self, dc, stype, damage=0, status=None):
         # handles saving throws for the fighter
         save = self.save_roll(dc, self.saves[stype])
@@ -279,13 +339,15 @@ class Fighter(PC, HB):
         while self.reroll and not save:
             save = self.save_roll(dc, self.saves[stype])
             self.reroll -= 1
+        if self.battle.log is not None:
+            self.battle.log.save(self, dc, stype, save, status)
 
         if damage and save and status:
-            self.hp -= int(damage/2) + 1
+            self.take_damage(int(damage/2) + 1)
         if damage and save and not status:
-            self.hp -= int(damage/2) + 1
+            self.take_damage(int(damage/2) + 1)
         elif damage and status and not save:
-            self.hp -= damage
+            self.take_damage(damage)
             self.status = status
             self.status_dc = dc
             self.status_save = stype
@@ -296,32 +358,46 @@ class Fighter(PC, HB):
             self.status_save = stype
 
     def take_action(self):
+        # the fighter's turn, as planned for its level in prepare()
+        self.plan(self)
+
+    def rally(self):
+        # from level 18 the fighter checks and uses the healing surge before its actions
+        if self.hp < self.base_hp / 2:
+            before = self.hp
+            if self.base_hp < self.hp + self.bonus.con + 5:
+                self.hp = self.base_hp
+            else:
+                self.hp += self.bonus.con + 5
+            if self.battle.log is not None:
+                self.battle.log.emit('heal', self.key, self.key, self.hp - before,
+                                        self.hp)
+        self.fight()
+
+    def fight(self):
         # chooses each action for the fighter and executes the action
         # fighter can have more than one action per turn
         acts = 0
 
-        # checks and uses the healing surge
-        if self.level >= 18 and self.hp < self.base_hp / 2:
-            if self.base_hp < self.hp + self.bonus['con'] + 5:
-                self.hp = self.base_hp
-            else:
-                self.hp += self.bonus['con'] + 5
-
         while acts < self.actions:
             if self.surge and acts > 0:
                 acts -= 1
                 self.surge -= 1
 
             if self.hp < self.base_hp and self.heal:
+                before = self.hp
                 if self.hp + self.heal > self.base_hp:
                     self.hp = self.base_hp
                 else:
                     self.hp += self.heal
                 self.heal = 0
+                if self.battle.log is not None:
+                    self.battle.log.emit('heal', self.key, self.key, self.hp - before,
+                                            self.hp)
             # makes an attack
-            elif HB.monsters:
-                t = self.get_target([m for m in HB.monsters.keys()])
-                target = HB.monsters[t]
+            elif self.battle.monsters:
+                t = self.get_target(self.battle.monster_pool)
+                target = self.battle.monsters[t]
                 self.make_attack(target, self.atk, self.roll_dice(1,10), self.crit)
             
             acts += 1
@@ -330,42 +406,32 @@ class Cleric(PC, HB):
     """
     Builds the cleric PC and handles all the mechanics for healing players.
     """
+    __slots__ = ('spell_atk', 'dc', 'spell_slots', 'crit', 'reroll', 'x_dmg')
 
     def assign_stats(self):
         # generates the PC stats based on the template
-        self.stats = {
-            'int': self.base_stats[4],
-            'wis': self.base_stats[0],
-            'con': self.base_stats[1],
-            'cha': self.base_stats[2],
-            'dex': self.base_stats[5],
-            'str': self.base_stats[3]
-        }
-    
-    def assign_bonus(self):
-        # creates stat bonuses
-        self.bonus = {
-            'int': self.get_bonus(self.stats['int']),
-            'wis': self.get_bonus(self.stats['wis']),
-            'cha': self.get_bonus(self.stats['cha']),
-            'str': self.get_bonus(self.stats['str']),
-            'dex': self.get_bonus(self.stats['dex']),
-            'con': self.get_bonus(self.stats['con']),
-        }
+        self.stats = Abilities(
+            int=self.base_stats[4],
+            wis=self.base_stats[0],
+            con=self.base_stats[1],
+            cha=self.base_stats[2],
+            dex=self.base_stats[5],
+            str=self.base_stats[3]
+        )
     
     def assign_saves(self):
         # creates the saving throws
-        self.saves = {
-            'str': self.bonus['str'],
-            'dex': self.bonus['dex'],
-            'con': self.bonus['con'] + self.pro,
-            'int': self.bonus['int'],
-            'wis': self.bonus['wis'] + self.pro,
-            'cha': self.bonus['cha']
-        }
-
-    def build(self):
-        # builds the cleric
+        self.saves = Abilities(
+            str=self.bonus.str,
+            dex=self.bonus.dex,
+            con=self.bonus.con + self.pro,
+            int=self.bonus.int,
+            wis=self.bonus.wis + self.pro,
+            cha=self.bonus.cha
+        )
+
+    def prepare(self):
+        # builds the cleric, all but the dice
         self.adjust_stats()
         self.assign_stats()
         self.assign_bonus()
@@ -375,13 +441,10 @@ class Cleric(PC, HB):
         self.stats_save = None
         self.status_dc = 0
         self.actions = 1
-        self.hp = 8 + self.bonus['con'] 
-        self.hp += self.roll_dice(self.level,8) + self.level * self.bonus['con']
-        self.base_hp = self.hp
-        self.ac = 14 + self.bonus['dex'] + 2 + 2
-        self.spell_atk = self.pro + self.bonus['wis']
+        self.ac = 14 + self.bonus.dex + 2 + 2
+        self.spell_atk = self.pro + self.bonus.wis
         self.dc = 8 + self.spell_atk
-        self.atk = self.pro + self.bonus['str']
+        self.atk = self.pro + self.bonus.str
         self.crit = 20
         self.reroll = 0
         self.x_dmg = 0
@@ -394,15 +457,26 @@ class Cleric(PC, HB):
         elif self.level >= 8:
             self.x_dmg = 8
 
+        self.plan = Cleric.minister if self.level >= 3 else Cleric.tend
+
+    def roll(self):
+        # rolls the cleric's HP and gives it its own spell slots to spend
+        self.hp = 8 + self.bonus.con 
+        self.hp += self.roll_dice(self.level,8) + self.level * self.bonus.con
+        self.base_hp = self.hp
+        self.spell_slots = list(self.spell_slots)
+
     def make_save(self, dc, stype, damage=0, status=None):
         # handles saving throws
         save = self.save_roll(dc, self.saves[stype])
+        if self.battle.log is not None:
+            self.battle.log.save(self, dc, stype, save, status)
         if damage and save and status:
-            self.hp -= int(damage/2) + 1
+            self.take_damage(int(damage/2) + 1)
         if damage and save and not status:
-            self.hp -= int(damage/2) + 1
+            self.take_damage(int(damage/2) + 1)
         elif damage and status and not save:
-            self.hp -= damage
+            self.take_damage(damage)
             self.status = status
             self.status_dc = dc
             self.status_save = stype
@@ -417,19 +491,20 @@ class Cleric(PC, HB):
         pgrave = []
         resurect = 1
 
-        for k,v in HB.dead.items():
+        for k,v in self.battle.dead.items():
             if resurect:
                 v.hp = 1
-                HB.party[k] = v
                 pgrave.append(k)
                 resurect = 0
 
         for p in pgrave:
-            del HB.dead[p]
+            self.battle.rise(p)
+            if self.battle.log is not None:
+                self.battle.log.emit('revive', self.key, p, 1)
 
     def need_healing(self):
         # determine who needs healing
-        return [x for x in HB.party.keys() if HB.party[x].hp < HB.party[x].base_hp]
+        return [x for x in self.battle.party.keys() if self.battle.party[x].hp < self.battle.party[x].base_hp]
     
     def get_spell_slots(self):
         return [x for x,y in enumerate(self.spell_slots) if y]
@@ -438,16 +513,20 @@ class Cleric(PC, HB):
         # returns the most injured PC for healng
         worst = patients[0]
         for p in patients:
-            if HB.party[p].hp < HB.party[worst].hp:
+            if self.battle.party[p].hp < self.battle.party[worst].hp:
                 worst = p
         return worst
     
     def cast_heal(self, target, heal):
         # handles the mechanics of healing other PCs
-        if HB.party[target].hp + heal + self.spell_atk > HB.party[target].base_hp:
-            HB.party[target].hp = HB.party[target].base_hp
+        before = self.battle.party[target].hp
+        if self.battle.party[target].hp + heal + self.spell_atk > self.battle.party[target].base_hp:
+            self.battle.party[target].hp = self.battle.party[target].base_hp
         else:
-            HB.party[target].hp += heal + self.spell_atk
+            self.battle.party[target].hp += heal + self.spell_atk
+        if self.battle.log is not None:
+            hp = self.battle.party[target].hp
+            self.battle.log.emit('heal', self.key, target, hp - before, hp)
 
     def take_action(self):
         # chooses the cleric's action for the turn and then executes the action
@@ -456,96 +535,92 @@ class Cleric(PC, HB):
         patients = self.need_healing()
         slots = self.get_spell_slots()
 
-        if len(self.spell_slots) > 4 and self.spell_slots[4] and HB.dead:
-            t = self.get_target([m for m in HB.monsters.keys()])
-            target = HB.monsters[t]
+        if len(self.spell_slots) > 4 and self.spell_slots[4] and self.battle.dead:
+            t = self.get_target(self.battle.monster_pool)
+            target = self.battle.monsters[t]
             self.make_attack(target, self.spell_atk, self.roll_dice(1,8))
             self.revive()
             self.spell_slots[4] -= 1
 
-        # chooses spells to cast
-        elif self.level >= 3:
-            if slots and patients:
-                sl = slots[-1]
-                if len(patients) > 2 and sl > 2:
-                    spell = HB.cleric_spells['heal_all'][sl]['heal']
-                    for patient in patients:
-                        self.cast_heal(patient, spell)
-                    self.spell_slots[sl] -= 1   
-                else:
-                    spell = HB.cleric_spells['heal_one_action'][sl]['heal']
-                    patient = self.most_dead(patients)
+        # chooses spells to cast, as planned for the cleric's level in prepare()
+        else:
+            self.plan(self, patients, slots)
+
+    def minister(self, patients, slots):
+        # from level 3 the cleric heals with its strongest slot and attacks in the same
+        # turn, or attacks twice when nobody needs healing
+        if slots and patients:
+            sl = slots[-1]
+            if len(patients) > 2 and sl > 2:
+                spell = HB.cleric_spells['heal_all'][sl]['heal']
+                for patient in patients:
                     self.cast_heal(patient, spell)
-                    self.spell_slots[sl] -= 1  
-                    
-                t = self.get_target([m for m in HB.monsters.keys()])
-                target = HB.monsters[t]
-                self.make_attack(target, self.atk, self.roll_dice(1,8), crit=20,
-                                    extra=self.x_dmg)        
-
-            # makes a basic attack
+                self.spell_slots[sl] -= 1   
             else:
-                attack = 1
-                while HB.monsters and attack <= 2:
-                    t = self.get_target([m for m in HB.monsters.keys()])
-                    target = HB.monsters[t]
-                    self.make_attack(target, self.atk, self.roll_dice(1,8), crit=20,
-                                        extra=self.x_dmg)
-                    attack += 1
+                spell = HB.cleric_spells['heal_one_action'][sl]['heal']
+                patient = self.most_dead(patients)
+                self.cast_heal(patient, spell)
+                self.spell_slots[sl] -= 1  
+                
+            t = self.get_target(self.battle.monster_pool)
+            target = self.battle.monsters[t]
+            self.make_attack(target, self.atk, self.roll_dice(1,8), crit=20,
+                                extra=self.x_dmg)        
 
+        # makes a basic attack
         else:
-            # does healing
-            if slots and patients:
-                sl = slots[-1]
-                spell = HB.cleric_spells['heal_one_action'][sl]['heal']
-                t = self.most_dead(patients)
-                self.cast_heal(t, spell)
-                self.spell_slots[sl] -= 1
-            else:
-                t = self.get_target([m for m in HB.monsters.keys()])
-                target = HB.monsters[t]
-                self.make_attack(target, self.atk, self.roll_dice(1,8))
+            attack = 1
+            while self.battle.monsters and attack <= 2:
+                t = self.get_target(self.battle.monster_pool)
+                target = self.battle.monsters[t]
+                self.make_attack(target, self.atk, self.roll_dice(1,8), crit=20,
+                                    extra=self.x_dmg)
+                attack += 1
+
+    def tend(self, patients, slots):
+        # below level 3 the cleric either heals or attacks
+        if slots and patients:
+            sl = slots[-1]
+            spell = HB.cleric_spells['heal_one_action'][sl]['heal']
+            t = self.most_dead(patients)
+            self.cast_heal(t, spell)
+            self.spell_slots[sl] -= 1
+        else:
+            t = self.get_target(self.battle.monster_pool)
+            target = self.battle.monsters[t]
+            self.make_attack(target, self.atk, self.roll_dice(1,8))
                 
 class Rogue(PC, HB):
     """
     Builds a rogue character of the specified level
     """
+    __slots__ = ('crit', 'reroll', 'x_dmg', 'sneak')
 
     def assign_stats(self):
         # generates the PC stats based on the template
-        self.stats = {
-            'int': self.base_stats[4],
-            'wis': self.base_stats[5],
-            'con': self.base_stats[2],
-            'cha': self.base_stats[3],
-            'dex': self.base_stats[0],
-            'str': self.base_stats[1]
-        }
-    
-    def assign_bonus(self):
-        # creates the stat bonuses for the PC
-        self.bonus = {
-            'int': self.get_bonus(self.stats['int']),
-            'wis': self.get_bonus(self.stats['wis']),
-            'cha': self.get_bonus(self.stats['cha']),
-            'str': self.get_bonus(self.stats['str']),
-            'dex': self.get_bonus(self.stats['dex']),
-            'con': self.get_bonus(self.stats['con']),
-        }
+        self.stats = Abilities(
+            int=self.base_stats[4],
+            wis=self.base_stats[5],
+            con=self.base_stats[2],
+            cha=self.base_stats[3],
+            dex=self.base_stats[0],
+            str=self.base_stats[1]
+        )
     
     def assign_saves(self):
         # generates the saving throw for the character
-        self.saves = {
-            'str': self.bonus['str'],
-            'dex': self.bonus['dex'] + self.pro,
-            'con': self.bonus['con'],
-            'int': self.bonus['int'] + self.pro,
-            'wis': self.bonus['wis'],
-            'cha': self.bonus['cha']
-        }
-
-    def build(self):
-        # builds the rogue character and creates all the stats and abilities
+        self.saves = Abilities(
+            str=self.bonus.str,
+            dex=self.bonus.dex + self.pro,
+            con=self.bonus.con,
+            int=self.bonus.int + self.pro,
+            wis=self.bonus.wis,
+            cha=self.bonus.cha
+        )
+
+    def prepare(self):
+        # builds the rogue character and creates all the stats and abilities that do not
+        # need the dice, which is everything but its HP and its sneak attack damage
         self.adjust_stats()
         self.assign_stats()
         self.assign_bonus()
@@ -555,61 +630,71 @@ class Rogue(PC, HB):
         self.stats_save = None
         self.status_dc = 0
         self.actions = 1
-        self.hp = 8 + self.bonus['con'] 
-        self.hp += self.roll_dice(self.level,8) + self.level * self.bonus['con']
-        self.base_hp = self.hp
-        self.ac = 12 + self.bonus['dex']
-        self.atk = self.pro + self.bonus['dex']
+        self.ac = 12 + self.bonus.dex
+        self.atk = self.pro + self.bonus.dex
         self.crit = 20
         self.reroll = 0
-        self.x_dmg = self.roll_dice(1,6) + self.atk
+        self.sneak = 1
         self.dodge = False
 
         if self.level == 20:
             self.reroll = 1
-            self.saves['wis'] += self.pro
+            self.saves = self.saves._replace(wis=self.saves.wis + self.pro)
             self.dodge = True
-            self.x_dmg = self.roll_dice(10,6) + self.atk
+            self.sneak = 10
         elif self.level >= 19:
-            self.saves['wis'] += self.pro
+            self.saves = self.saves._replace(wis=self.saves.wis + self.pro)
             self.dodge = True  
-            self.x_dmg = self.roll_dice(10,6) + self.atk  
+            self.sneak = 10
         elif self.level >= 17:
-            self.saves['wis'] += self.pro
+            self.saves = self.saves._replace(wis=self.saves.wis + self.pro)
             self.dodge = True  
-            self.x_dmg = self.roll_dice(9,6) + self.atk         
+            self.sneak = 9
         elif self.level >= 15:
-            self.saves['wis'] += self.pro
+            self.saves = self.saves._replace(wis=self.saves.wis + self.pro)
             self.dodge = True
-            self.x_dmg = self.roll_dice(8,6) + self.atk
+            self.sneak = 8
         elif self.level >= 13:
             self.dodge = True
-            self.x_dmg = self.roll_dice(7,6) + self.atk 
+            self.sneak = 7
         elif self.level >= 11:
             self.dodge = True
-            self.x_dmg = self.roll_dice(6,6) + self.atk
+            self.sneak = 6
         elif self.level >= 9:
             self.dodge = True
-            self.x_dmg = self.roll_dice(5,6) + self.atk
+            self.sneak = 5
         elif self.level >= 7:
             self.dodge = True
-            self.x_dmg = self.roll_dice(4,6) + self.atk
+            self.sneak = 4
         elif self.level >= 5:
             self.dodge = True
-            self.x_dmg = self.roll_dice(3,6) + self.atk
+            self.sneak = 3
         elif self.level >= 3:
-            self.x_dmg = self.roll_dice(2,6) + self.atk
+            self.sneak = 2
+
+        self.plan = Rogue.ambush if self.level >= 17 else Rogue.strike
+
+    def roll(self):
+        # rolls the rogue's HP and its sneak attack damage for the encounter
+        self.hp = 8 + self.bonus.con 
+        self.hp += self.roll_dice(self.level,8) + self.level * self.bonus.con
+        self.base_hp = self.hp
+        self.x_dmg = self.roll_dice(1,6) + self.atk
+        if self.sneak > 1:
+            self.x_dmg = self.roll_dice(self.sneak,6) + self.atk
 
     def make_save(self, dc, stype, damage=0, status=None):
         # handles the saving throw for the PC when affected by a status
         save = self.save_roll(dc, self.saves[stype])
+        if self.battle.log is not None:
+            self.battle.log.save(self, dc, stype, save, status)
         if self.level >= 7 and stype == 'dex':
             if damage and save and status:
-                self.hp -= int(damage/2) + 1
+                self.take_damage(int(damage/2) + 1)
             if damage and save and not status:
-                self.hp -= int(damage/2) + 1
+                self.take_damage(int(damage/2) + 1)
             elif damage and status and not save:
-                self.hp -= damage
+                self.take_damage(damage)
                 self.status = status
                 self.status_dc = dc
                 self.status_save = stype
@@ -620,11 +705,11 @@ class Rogue(PC, HB):
                 self.status_save = stype
         else:
             if damage and save and status:
-                self.hp -= int(damage/2) + 1
+                self.take_damage(int(damage/2) + 1)
             if damage and save and not status:
-                self.hp -= int(damage/2) + 1
+                self.take_damage(int(damage/2) + 1)
             elif damage and status and not save:
-                self.hp -= damage
+                self.take_damage(damage)
                 self.status = status
                 self.status_dc = dc
                 self.status_save = stype
@@ -635,17 +720,25 @@ class Rogue(PC, HB):
                 self.status_save = stype
 
     def take_action(self):
-        # picks the action for the PC to take on this turn then executes their action
-        if HB.round == 0 and self.level >= 17:
+        # the rogue's turn, as planned for its level in prepare()
+        self.plan(self)
+
+    def ambush(self):
+        # from level 17 the rogue attacks twice in the first round
+        if self.battle.round == 0:
             attacks = 2
-            while HB.monsters and attacks > 0:
-                t = self.get_target([m for m in HB.monsters.keys()])
-                target = HB.monsters[t]
+            while self.battle.monsters and attacks > 0:
+                t = self.get_target(self.battle.monster_pool)
+                target = self.battle.monsters[t]
                 self.make_attack(target, self.atk, self.roll_dice(1,8), crit=self.crit, 
                                     extra=self.x_dmg)
                 attacks -= 1
         else:
-            t = self.get_target([m for m in HB.monsters.keys()])
-            target = HB.monsters[t]
-            self.make_attack(target, self.atk, self.roll_dice(1,8), crit=self.crit, 
-                                extra=self.x_dmg)
\ No newline at end of file
+            self.strike()
+
+    def strike(self):
+        # a single sneak attack
+        t = self.get_target(self.battle.monster_pool)
+        target = self.battle.monsters[t]
+        self.make_attack(target, self.atk, self.roll_dice(1,8), crit=self.crit, 
+                            extra=self.x_dmg)
\ No newline at end of file
@@ -0,0 +1,206 @@
+"""
+Counts the calls to, and adds up the time spent in, each phase of an encounter: the
+build, the initiative, the actions of each class, the attacks, saves, deaths, dice and
+targeting and the cleric's healing, as well as the rounds each fight lasted.
+
+A Profiler only costs anything in the encounters it is given to. An Encounter given a
+profiler hands itself to the profiler at the start of combat(), which wraps the methods
+of each phase of that encounter alone with a counting and timing wrapper: the methods of
+the Encounter, its Battle and squads are wrapped on the objects themselves, and each PC
+and monster is given a subclass of its class with the wrapped methods, which the
+profiler makes once for every class. The classes themselves are never touched, so
+encounters run without a profiler, in this thread or any other, go through exactly the
+same code as before.
+
+    profiler = Profiler()
+    for i in range(1000):
+        Encounter(characters, 4, {'Goblin': 7}, Dice(i), profiler=profiler).combat()
+    print(profiler.table())
+
+The times are inclusive, so the time of a take_action includes that of the attacks
+and saves it makes, and the phases do not add up to the time of the fights.
+
+Run with:
+    python profiling.py [level] [iterations] [--json]
+"""
+
+import json
+import sys
+import time
+from functools import wraps
+from creatures import CreatureFeature, Squad, SquadMember
+from encounter import Encounter
+from handbook import HandBook as HB, Battle
+import party
+
+# (class, method, phase) of every method a Profiler times
+HOOKS = [
+    (Encounter, 'build_encounter', 'build'),
+    (Encounter, 'build_party', 'build party'),
+    (Encounter, 'build_monsters', 'build monsters'),
+    (Encounter, 'build_initiative', 'initiative'),
+    (Encounter, 'build_turns', 'build turns'),
+    (party.Wizard, 'take_action', 'take_action (wizard)'),
+    (party.Fighter, 'take_action', 'take_action (fighter)'),
+    (party.Cleric, 'take_action', 'take_action (cleric)'),
+    (party.Rogue, 'take_action', 'take_action (rogue)'),
+    (CreatureFeature, 'take_action', 'take_action (monster)'),
+    (SquadMember, 'take_action', 'take_action (monster)'),
+    (HB, 'make_attack', 'make_attack'),
+    (party.Wizard, 'make_save', 'make_save'),
+    (party.Fighter, 'make_save', 'make_save'),
+    (party.Cleric, 'make_save', 'make_save'),
+    (party.Rogue, 'make_save', 'make_save'),
+    (CreatureFeature, 'make_save', 'make_save'),
+    (SquadMember, 'make_save', 'make_save'),
+    (Squad, 'save_all', 'make_save (squad)'),
+    (Battle, 'fall', 'fall'),
+    (HB, 'roll_dice', 'roll_dice'),
+    (HB, 'get_target', 'get_target'),
+    (party.Cleric, 'need_healing', 'cleric need_healing'),
+    (party.Cleric, 'cast_heal', 'cleric cast_heal'),
+    (party.Cleric, 'revive', 'cleric revive')
+    ]
+
+class Profiler():
+    """
+    The counts and times of the phases of the encounters it was given to.
+
+    Attributes:
+        hooks: list, the (class, method, phase) to time, HOOKS by default
+        calls: dict, {phase: number of calls}
+        seconds: dict, {phase: seconds spent in the calls}
+        fights: int, the number of calls to Encounter.combat()
+        rounds: int, the rounds all those fights took together
+    """
+
+    def __init__(self, hooks=None):
+        self.hooks = HOOKS if hooks is None else hooks
+        self.calls = {}
+        self.seconds = {}
+        self.fights = 0
+        self.rounds = 0
+        # the timed subclass of each class of PC and monster
+        self.classes = {}
+
+    def timed(self, method, phase):
+        # wraps method so each call adds to the count and the time of phase
+        calls, seconds, clock = self.calls, self.seconds, time.perf_counter
+
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds[phase] = seconds.get(phase, 0.0) + clock() - start
+                calls[phase] = calls.get(phase, 0) + 1
+        return wrapper
+
+    def timed_class(self, cls):
+        """
+        Returns:
+            type, a subclass of cls with the same slots and the methods of its hooks
+                wrapped, made the first time it is asked for
+        """
+        timed = self.classes.get(cls)
+        if timed is None:
+            methods = {'__slots__': ()}
+            for owner, name, phase in self.hooks:
+                if issubclass(cls, owner) and name not in methods:
+                    methods[name] = self.timed(getattr(cls, name), phase)
+            timed = self.classes[cls] = type(cls.__name__, (cls,), methods)
+        return timed
+
+    def instrument(self, thing):
+        # wraps the methods of the hooks of an Encounter, Battle or Squad on the object
+        cls = type(thing)
+        for owner, name, phase in self.hooks:
+            if isinstance(thing, owner):
+                # the method of the class, so a second fight is not timed twice over
+                method = getattr(cls, name).__get__(thing, cls)
+                setattr(thing, name, self.timed(method, phase))
+
+    def begin(self, encounter):
+        """
+        Instruments an encounter at the start of its combat(), then its battle and
+        everyone in it once it is built.
+
+        Returns:
+            float, the time the fight started
+        """
+        self.instrument(encounter)
+        build = encounter.build_encounter
+
+        @wraps(build)
+        def built():
+            build()
+            battle = encounter.battle
+            self.instrument(battle)
+            for critter in list(battle.party.values()) + list(battle.monsters.values()):
+                critter.__class__ = self.timed_class(type(critter))
+                squad = getattr(critter, 'squad', None)
+                if squad is not None and 'save_all' not in vars(squad):
+                    self.instrument(squad)
+
+        encounter.build_encounter = built
+        return time.perf_counter()
+
+    def end(self, encounter, start):
+        # counts a fight that started at start, and the rounds it took
+        elapsed = time.perf_counter() - start
+        self.seconds['combat'] = self.seconds.get('combat', 0.0) + elapsed
+        self.calls['combat'] = self.calls.get('combat', 0) + 1
+        battle = encounter.battle
+        self.fights += 1
+        self.rounds += battle.round + (1 if battle.turn else 0)
+
+    def summary(self):
+        """
+        Returns:
+            dict, the fights, rounds and rounds per fight, and {phase: {'calls': int,
+                'seconds': float, 'us_per_call': float}} for every phase called
+        """
+        phases = {}
+        for phase, seconds in sorted(self.seconds.items(), key=lambda p: -p[1]):
+            calls = self.calls[phase]
+            phases[phase] = {'calls': calls, 'seconds': seconds,
+                                'us_per_call': seconds / calls * 1e6}
+        return {
+            'fights': self.fights,
+            'rounds': self.rounds,
+            'rounds_per_fight': self.rounds / self.fights if self.fights else 0.0,
+            'phases': phases
+            }
+
+    def table(self):
+        """
+        Returns:
+            str, the summary as a table, the slowest phases first
+        """
+        summary = self.summary()
+        lines = [f"{summary['fights']} fights, {summary['rounds_per_fight']:.2f} rounds "
+                    "per fight",
+                    f"{'phase':24s} {'calls':>10s} {'seconds':>9s} {'us/call':>9s}"]
+        for phase, p in summary['phases'].items():
+            lines.append(f"{phase:24s} {p['calls']:10d} {p['seconds']:9.3f} "
+                            f"{p['us_per_call']:9.2f}")
+        return '\n'.join(lines)
+
+if __name__ == "__main__":
+    from dice import Dice
+    from runner import iteration_seed
+    args = [a for a in sys.argv[1:] if a != '--json']
+    lvl = int(args[0]) if args else 4
+    iterations = int(args[1]) if len(args) > 1 else 1000
+    characters = ['cleric', 'fighter', 'rogue', 'wizard']
+    mob = {'Worg': 3, 'Goblin': 7}
+
+    profiler = Profiler()
+    for i in range(iterations):
+        dice = Dice(iteration_seed(0, i))
+        Encounter(characters, lvl, mob, dice, profiler=profiler).combat()
+    if '--json' in sys.argv:
+        print(json.dumps(profiler.summary(), indent=2))
+    else:
+        print(profiler.table())
@@ -0,0 +1,243 @@
+"""
+Runs many iterations of the same encounter across a pool of worker processes. Every
+iteration rolls with its own Dice, seeded from the master seed and the iteration
+number, so the results of a run only depend on the seed and never on how many workers
+shared the work.
+
+run_many() returns the result of every iteration, tally_many() only keeps the running
+totals of a Tally and so uses the same memory for any number of iterations.
+tally_until() keeps adding batches of iterations until the confidence interval of the
+win rate is as narrow as asked for.
+
+Since every iteration only depends on the master seed and its own number, replay()
+runs any single iteration of a batch again, with the same rolls, without running the
+ones before it, and can log every event of the fight while it does.
+
+Replay an iteration with:
+    python runner.py seed index level Creature=number [Creature=number ...] [--log file]
+"""
+
+import hashlib
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dice import Dice
+from encounter import Encounter
+from events import EventLog
+from tally import Tally
+
+CHARACTERS = ['cleric', 'fighter', 'rogue', 'wizard']
+
+def iteration_seed(seed, index):
+    """
+    Derives the random seed for a single iteration of a batch.
+
+    Attributes:
+        seed: int, the master seed of the batch
+        index: int, the number of the iteration within the batch
+
+    Returns:
+        int, a 64 bit seed unique to the iteration
+    """
+    digest = hashlib.sha256(f'{seed}:{index}'.encode()).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+def replay(protagonists, level, antagonists, seed, index, log=None):
+    """
+    Runs the iteration numbered index of a batch again, with exactly the rolls it had in
+    the batch.
+
+    Attributes:
+        protagonists, level, antagonists: as for run_many()
+        seed: int, the master seed of the batch, Tally.seed of its totals
+        index: int, the number of the iteration within the batch
+        log: str, a file to write every event of the fight to, see events.py
+
+    Returns:
+        tuple, the result of Encounter.combat() and the Encounter, whose battle holds
+            the state the fight ended in
+    """
+    dice = Dice(iteration_seed(seed, index))
+    if log is None:
+        encounter = Encounter(protagonists, level, antagonists, dice)
+        return encounter.combat(), encounter
+    meta = {'protagonists': protagonists, 'level': level, 'antagonists': antagonists,
+            'seed': seed}
+    with EventLog(log, meta, first=index) as events:
+        encounter = Encounter(protagonists, level, antagonists, dice, log=events)
+        return encounter.combat(), encounter
+
+def run_chunk(protagonists, level, antagonists, seed, start, stop):
+    """
+    Runs the iterations numbered start to stop - 1 of a batch in the current process.
+
+    Returns:
+        list, the result of Encounter.combat() for each iteration in order
+    """
+    results = []
+    for i in range(start, stop):
+        dice = Dice(iteration_seed(seed, i))
+        results.append(Encounter(protagonists, level, antagonists, dice).combat())
+    return results
+
+def tally_chunk(protagonists, level, antagonists, seed, start, stop, bins=10):
+    """
+    Runs the iterations numbered start to stop - 1 of a batch in the current process,
+    keeping only their running totals.
+
+    Returns:
+        Tally, the totals of the iterations
+    """
+    tally = Tally(bins)
+    for i in range(start, stop):
+        dice = Dice(iteration_seed(seed, i))
+        encounter = Encounter(protagonists, level, antagonists, dice)
+        result = encounter.combat()
+        battle = encounter.battle
+        tally.add(result, battle.round + (1 if battle.turn else 0))
+    return tally
+
+def map_chunks(task, protagonists, level, antagonists, iterations, workers, seed, chunk,
+                *args, first=0, pool=None):
+    """
+    Splits the iterations numbered first to first + iterations - 1 into chunks and runs
+    task on each of them, across a process pool unless workers is 1.
+
+    Attributes:
+        pool: ProcessPoolExecutor, an open pool to use instead of starting one
+
+    Returns:
+        list, what task returned for each chunk in order
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    end = first + iterations
+    bounds = [(s, min(s + chunk, end)) for s in range(first, end, chunk)]
+
+    if workers == 1 or len(bounds) == 1:
+        return [task(protagonists, level, antagonists, seed, start, stop, *args)
+                for start, stop in bounds]
+    if pool:
+        futures = [pool.submit(task, protagonists, level, antagonists, seed, start, stop,
+                                *args) for start, stop in bounds]
+        return [f.result() for f in futures]
+    with ProcessPoolExecutor(workers) as pool:
+        return map_chunks(task, protagonists, level, antagonists, iterations, workers,
+                            seed, chunk, *args, first=first, pool=pool)
+
+def run_many(protagonists, level, antagonists, iterations, workers=None, seed=None,
+                chunk=250):
+    """
+    Runs an encounter a number of times, spreading the iterations across a process pool.
+
+    Attributes:
+        protagonists: list, the character classes in the PC party
+        level: int, the party level
+        antagonists: dict, the creatures to fight in the format {creature: number}
+        iterations: int, the number of times to run the encounter
+        workers: int, the number of worker processes, defaults to the number of CPUs;
+            1 runs every iteration in the current process
+        seed: int, the master seed for the batch, a random one is picked if not given
+        chunk: int, the number of iterations handed to a worker at a time
+
+    Returns:
+        list, the result of Encounter.combat() for every iteration in order; a dict of
+            the surviving PCs on a party win and None otherwise
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    chunks = map_chunks(run_chunk, protagonists, level, antagonists, iterations, workers,
+                        seed, chunk)
+    return [r for c in chunks for r in c]
+
+def tally_many(protagonists, level, antagonists, iterations, workers=None, seed=None,
+                chunk=250, bins=10):
+    """
+    Runs an encounter a number of times like run_many(), but every worker only keeps the
+    running totals of its iterations and the totals are merged at the end.
+
+    Attributes:
+        protagonists, level, antagonists, iterations, workers, seed, chunk: as for
+            run_many()
+        bins: int, the number of bins of the HP histograms, see Tally
+
+    Returns:
+        Tally, the totals of every iteration
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    tally = Tally(bins)
+    tally.seed = seed
+    for t in map_chunks(tally_chunk, protagonists, level, antagonists, iterations, workers,
+                        seed, chunk, bins):
+        tally.merge(t)
+    return tally
+
+def tally_until(protagonists, level, antagonists, margin=0.005, confidence=0.95,
+                method='wilson', batch=500, max_iterations=100000, workers=None, seed=None,
+                chunk=250, bins=10):
+    """
+    Runs an encounter in batches until the confidence interval of its win rate is no
+    wider than the win rate +/- margin. Lopsided encounters stop after a batch or two
+    while close ones keep going, up to max_iterations.
+
+    The interval is only checked between batches, so for a given seed and batch size
+    the iterations used and the totals are the same for any number of workers.
+
+    Attributes:
+        protagonists, level, antagonists, workers, seed, chunk, bins: as for tally_many()
+        margin: float, the largest half width of the interval to stop at
+        confidence: float, the confidence level of the interval
+        method: str, the interval to use, 'wilson' or 'clopper-pearson'
+        batch: int, the number of iterations run between checks of the interval
+        max_iterations: int, the most iterations to run whatever the interval
+
+    Returns:
+        Tally, the totals of every iteration run; Tally.iterations is the number used
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    tally = Tally(bins)
+    tally.seed = seed
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        while tally.iterations < max_iterations:
+            size = min(batch, max_iterations - tally.iterations)
+            for t in map_chunks(tally_chunk, protagonists, level, antagonists, size,
+                                workers, seed, chunk, bins, first=tally.iterations,
+                                pool=pool):
+                tally.merge(t)
+            lower, upper = tally.win_interval(confidence, method)
+            if (upper - lower) / 2 <= margin:
+                break
+    finally:
+        if pool:
+            pool.shutdown()
+    return tally
+
+if __name__ == "__main__":
+    args = list(sys.argv[1:])
+    path = None
+    if '--log' in args:
+        path = args.pop(args.index('--log') + 1)
+        args.remove('--log')
+    master, index, lvl = int(args[0]), int(args[1]), int(args[2])
+    mob = {}
+    for a in args[3:]:
+        name, number = a.rsplit('=', 1)
+        mob[name] = int(number)
+
+    result, encounter = replay(CHARACTERS, lvl, mob, master, index, path)
+    battle = encounter.battle
+    rounds = battle.round + (1 if battle.turn else 0)
+    print(f'Iteration {index} of seed {master}: '
+            f"{'party win' if result else 'party loss'} after {rounds} rounds")
+    for name, (hp, base_hp) in (result or {}).items():
+        print(f'    {name:10s} {hp:4d}/{base_hp} HP')
+    print(f"    dead: {', '.join(battle.dead) or 'none'}")
+    print(f"    killed: {', '.join(battle.killed) or 'none'}")
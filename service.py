@@ -0,0 +1,365 @@
+"""
+Serves encounter simulations over a local HTTP/JSON endpoint, so a web tool can ask for
+the odds of an encounter without starting a new Python process, loading the monster
+manual and building the party templates for every query.
+
+The server is a single asyncio event loop in front of a pool of worker processes that
+load the monster catalog and the PC templates of every class and level when they start
+and keep them for as long as the server runs. A query is split into chunks of
+iterations that are handed to the workers, and the totals are streamed back as they
+come in, one JSON object per line, each with the win rate and its confidence interval
+so far. The last line holds the full results.
+
+Queries that ask for the same encounter with the same seed while it is being run share
+a single run: the later ones are sent the progress made so far and then follow along.
+Queries without a seed ask for the odds of the encounter rather than for a particular
+run, so they share a run of the same encounter and iterations whatever its seed.
+
+Only a couple of chunks per worker are handed to the pool at a time, and more as they
+finish. A run that every client has left is stopped, and the chunks already handed out
+are the most it goes on costing the workers. A run that fails in a worker sends its
+clients a line with the error before it ends.
+
+    POST /simulate  {"protagonists": [...], "level": 4, "antagonists": {"Goblin": 7},
+                     "iterations": 10000, "seed": 1}
+    GET /health
+
+The seed is optional, a run of a query without one is given a random seed when it
+starts.
+
+Given a ResultCache, see cache.py, the service answers a query that has been run before
+straight from the cache with a single line, and stores the totals of every run that
+finishes. A query without a seed is answered by any cached run of the encounter with at
+least the iterations asked for.
+
+Run with:
+    python service.py [port]
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from cache import encounter_key
+from catalog import load_catalog
+from runner import tally_chunk
+from tally import Tally
+import party
+
+CLASSES = {'cleric': party.Cleric, 'fighter': party.Fighter, 'rogue': party.Rogue,
+            'wizard': party.Wizard}
+
+MAX_ITERATIONS = 1000000
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}
+
+def warm():
+    # runs once in every worker, so no query pays for the catalog or the templates
+    load_catalog()
+    for cls in CLASSES.values():
+        for level in range(1, 21):
+            cls.from_template(level)
+
+def summary(tally, iterations=None):
+    """
+    The totals of a Tally as plain JSON types.
+
+    Attributes:
+        tally: Tally, the totals so far
+        iterations: int, the iterations asked for, if the run is still going
+
+    Returns:
+        dict, the progress of the run and its win rate, survival rates and rounds
+    """
+    lower, upper = tally.win_interval()
+    return {
+        'done': tally.iterations,
+        'iterations': iterations if iterations is not None else tally.iterations,
+        'seed': tally.seed,
+        'win_rate': tally.win_rate(),
+        'interval': [lower, upper],
+        'survivors': {str(k): v / tally.iterations for k, v in tally.survivors.items()},
+        'survival': {k: tally.survival_rate(k) for k in tally.alive},
+        'rounds': tally.mean,
+        'rounds_sd': tally.rounds_variance() ** 0.5
+        }
+
+def parse_query(body):
+    """
+    Checks a query and puts it in the form the runner takes.
+
+    Returns:
+        tuple, the protagonists, level, antagonists, iterations and seed, None if the
+            query did not give one
+
+    Raises:
+        ValueError, with a message for the client, if the query is not valid
+    """
+    try:
+        query = json.loads(body)
+        protagonists = [p.lower() for p in query['protagonists']]
+        level = int(query['level'])
+        antagonists = {str(k): int(v) for k, v in query['antagonists'].items()}
+        iterations = int(query.get('iterations', 10000))
+        seed = query.get('seed')
+        seed = None if seed is None else int(seed)
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError(f'a query needs protagonists, level and antagonists: {e}')
+
+    if not protagonists or any(p not in CLASSES for p in protagonists):
+        raise ValueError(f"the protagonists can only be {', '.join(CLASSES)}")
+    if not 1 <= level <= 20:
+        raise ValueError('the level must be from 1 to 20')
+    catalog = load_catalog()
+    unknown = [a for a in antagonists if a not in catalog]
+    if unknown:
+        raise ValueError(f"unknown creatures: {', '.join(unknown)}")
+    if not antagonists or any(n < 1 for n in antagonists.values()):
+        raise ValueError('there must be at least one of every creature')
+    if not 1 <= iterations <= MAX_ITERATIONS:
+        raise ValueError(f'the iterations must be from 1 to {MAX_ITERATIONS}')
+    return protagonists, level, antagonists, iterations, seed
+
+def discard(future):
+    # retrieves the outcome of a future nobody waits for, so asyncio does not report it
+    if not future.cancelled():
+        future.exception()
+
+class Run():
+    """
+    A query being run on the worker pool, and the clients following it.
+
+    Attributes:
+        query: tuple, what parse_query() returned, with a random seed drawn for the run
+            if it did not give one
+        key: tuple, the key of the run in Service.runs
+        tally: Tally, the totals of the chunks finished so far
+        updates: list, the summaries sent out so far, the last one being the latest
+        listeners: list, an asyncio.Queue for each client following the run
+        finished: boolean, True once every chunk is in
+    """
+
+    def __init__(self, query, key):
+        if query[4] is None:
+            query = query[:4] + (random.SystemRandom().getrandbits(64),)
+        self.query = query
+        self.key = key
+        self.tally = Tally()
+        self.tally.seed = query[4]
+        self.updates = []
+        self.listeners = []
+        self.finished = False
+        self.task = None
+
+    def publish(self, update):
+        # sends an update to every client, None tells them the run is over
+        if update is not None:
+            self.updates.append(update)
+        for queue in self.listeners:
+            queue.put_nowait(update)
+
+    def follow(self):
+        # a queue of the updates for a new client, starting with the latest so far
+        queue = asyncio.Queue()
+        if self.updates:
+            queue.put_nowait(self.updates[-1])
+        if self.finished:
+            queue.put_nowait(None)
+        self.listeners.append(queue)
+        return queue
+
+class Service():
+    """
+    The simulation server.
+
+    Attributes:
+        workers: int, the number of worker processes, defaults to the number of CPUs
+        chunk: int, the iterations handed to a worker at a time, and so how often the
+            progress is updated
+        cache: ResultCache, the results of earlier runs, if they are to be kept
+    """
+
+    def __init__(self, workers=None, chunk=500, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk = chunk
+        self.cache = cache
+        # the workers are spawned rather than forked, so they never inherit the sockets
+        # of the connections open when they start
+        spawn = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=spawn, initializer=warm)
+        # the cache is read and written on a thread of its own, off the event loop
+        self.io = ThreadPoolExecutor(1)
+        self.runs = {}
+
+    @staticmethod
+    def key(query):
+        # identical queries have identical keys, whatever the order of the creatures;
+        # queries without a seed share any run of the encounter and iterations
+        protagonists, level, antagonists, iterations, seed = query
+        if seed is None:
+            return (encounter_key(protagonists, level, antagonists), iterations)
+        return (tuple(protagonists), level, tuple(sorted(antagonists.items())),
+                iterations, seed)
+
+    async def execute(self, run):
+        # hands the chunks of the run to the pool a few at a time and merges them as they
+        # come back, so a cancelled run leaves no more than those few to the workers
+        protagonists, level, antagonists, iterations, seed = run.query
+        loop = asyncio.get_running_loop()
+        starts = iter(range(0, iterations, self.chunk))
+        pending = set()
+        submitted = []
+
+        def submit():
+            start = next(starts, None)
+            if start is not None:
+                f = loop.run_in_executor(self.pool, tally_chunk, protagonists, level,
+                                            antagonists, seed, start,
+                                            min(start + self.chunk, iterations))
+                pending.add(f)
+                submitted.append(f)
+
+        try:
+            for i in range(2 * self.workers):
+                submit()
+            while pending:
+                done, pending = await asyncio.wait(pending,
+                                                    return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    run.tally.merge(f.result())
+                    run.publish(summary(run.tally, iterations))
+                    submit()
+            if self.cache is not None:
+                await loop.run_in_executor(self.io, self.cache.put, protagonists, level,
+                                            antagonists, iterations, seed, run.tally)
+        except Exception as e:
+            # the clients are told, rather than seeing the run end as if it were done
+            run.publish({'error': f'the run failed: {e!r}'})
+        finally:
+            for f in submitted:
+                # the outcome of a chunk that can no longer be cancelled, or that finished
+                # alongside a failed one, is dropped
+                if not f.cancel():
+                    f.add_done_callback(discard)
+            run.finished = True
+            run.publish(None)
+            self.runs.pop(run.key, None)
+
+    def join(self, query):
+        """
+        Starts a run of the query, or joins the one already running it.
+
+        Returns:
+            tuple, the Run and the queue of its updates for the client
+        """
+        key = self.key(query)
+        run = self.runs.get(key)
+        if run is None:
+            run = Run(query, key)
+            self.runs[key] = run
+            run.task = asyncio.ensure_future(self.execute(run))
+        return run, run.follow()
+
+    def leave(self, run, queue):
+        # a client gone before the end; a run nobody follows any more is stopped
+        if queue in run.listeners:
+            run.listeners.remove(queue)
+        if not run.listeners and not run.finished:
+            run.task.cancel()
+
+    async def handle(self, reader, writer):
+        # handles a single HTTP request on a connection, then closes it
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            lines = request.decode('latin-1').split('\r\n')
+            method, path = lines[0].split(' ')[:2]
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    k, v = line.split(':', 1)
+                    headers[k.strip().lower()] = v.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            if method == 'GET' and path == '/health':
+                await self.respond(writer, 200, {'status': 'ok', 'runs': len(self.runs)})
+            elif method == 'POST' and path == '/simulate':
+                try:
+                    query = parse_query(body)
+                except ValueError as e:
+                    await self.respond(writer, 400, {'error': str(e)})
+                else:
+                    await self.stream(writer, query)
+            else:
+                await self.respond(writer, 404, {'error': f'no {method} {path}'})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            await self.respond(writer, 400, {'error': 'bad request'})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, data):
+        # writes a whole JSON response
+        body = json.dumps(data).encode()
+        writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                        'Content-Type: application/json\r\n'
+                        f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                        .encode() + body)
+        await writer.drain()
+
+    async def stream(self, writer, query):
+        # writes the updates of a run as they come, one JSON line per HTTP chunk
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                        b'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+        tally = None
+        if self.cache is not None:
+            loop = asyncio.get_running_loop()
+            tally = await loop.run_in_executor(self.io, self.cache.get, *query)
+        if tally is not None:
+            update = dict(summary(tally), cached=True)
+            line = json.dumps(update).encode() + b'\n'
+            writer.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(line), line))
+            await writer.drain()
+            return
+        run, queue = self.join(query)
+        try:
+            while True:
+                update = await queue.get()
+                if update is None:
+                    break
+                line = json.dumps(update).encode() + b'\n'
+                writer.write(b'%x\r\n%s\r\n' % (len(line), line))
+                await writer.drain()
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            self.leave(run, queue)
+
+    async def start(self):
+        # starts every worker, and waits for it to warm up, before any client connects
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, os.getpid)
+                                for i in range(self.workers)])
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        # serves until cancelled
+        await self.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+            self.io.shutdown()
+
+if __name__ == "__main__":
+    from cache import ResultCache
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    print(f'Serving simulations on http://127.0.0.1:{port}')
+    try:
+        asyncio.run(Service(cache=ResultCache()).serve(port=port))
+    except KeyboardInterrupt:
+        pass
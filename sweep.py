@@ -0,0 +1,193 @@
+"""
+Sweeps the difficulty of every creature across the party levels. For each cell of the
+grid, a party level and a creature from creature_list.json, it finds the largest mob of
+the creature the party still beats at least half of the time, using an exponential
+search followed by a bisection over the mob size. Each mob size is only run until the
+confidence interval of its win rate clears 50%, so lopsided sizes cost a few hundred
+iterations and only the sizes close to the threshold cost many.
+
+Cells are spread across a pool of worker processes and every finished cell is appended
+to a checkpoint file, one JSON object per line, so an interrupted sweep picks up where
+it left off when it is run again with the same file. A cell that fails, or a creature
+that is not in the monster catalog, is reported in the results with its error but is
+left out of the checkpoint, so it is tried again when the sweep is resumed.
+
+Run the full grid with:
+    python sweep.py [checkpoint file]
+"""
+
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from catalog import load_catalog
+from runner import iteration_seed, tally_chunk
+from tally import Tally
+
+CREATURE_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'creature_list.json')
+
+def cell_seed(seed, level, creature, count):
+    """
+    The master seed of the iterations probe() runs for a mob size of a cell, which
+    runner.replay() takes to run any one of them again.
+    """
+    return iteration_seed(f'{seed}:{level}:{creature}', count)
+
+def probe(protagonists, level, creature, count, seed, confidence=0.95, batch=200,
+            max_iterations=5000):
+    """
+    Runs the party against count of the creature until the confidence interval of the win
+    rate no longer holds 50%, or until max_iterations.
+
+    Returns:
+        Tally, the totals of the iterations run
+    """
+    seed = cell_seed(seed, level, creature, count)
+    tally = Tally()
+    tally.seed = seed
+    while tally.iterations < max_iterations:
+        stop = min(tally.iterations + batch, max_iterations)
+        tally.merge(tally_chunk(protagonists, level, {creature: count}, seed,
+                                tally.iterations, stop))
+        lower, upper = tally.win_interval(confidence)
+        if lower > 0.5 or upper < 0.5:
+            break
+    return tally
+
+def find_threshold(protagonists, level, creature, seed, max_count=64, **kwargs):
+    """
+    Finds the largest number of the creature the party beats at least half of the time,
+    assuming a bigger mob is never easier.
+
+    Attributes:
+        max_count: int, the largest mob tried
+        kwargs: passed on to probe()
+
+    Returns:
+        dict, the cell of the results table: the largest mob won (0 when a single creature
+            is too much, max_count when the party wins against every mob tried), the win
+            rates either side of the threshold, None for a side that was never probed,
+            and the iterations used
+    """
+    rates = {}
+    iterations = 0
+
+    def wins(count):
+        nonlocal iterations
+        tally = probe(protagonists, level, creature, count, seed, **kwargs)
+        iterations += tally.iterations
+        rates[count] = tally.win_rate()
+        return rates[count] >= 0.5
+
+    # doubles the mob until the party loses, then bisects between the last two sizes
+    lo, hi = 0, 1
+    while hi <= max_count and wins(hi):
+        lo, hi = hi, hi * 2
+    hi = min(hi, max_count + 1)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if wins(mid):
+            lo = mid
+        else:
+            hi = mid
+
+    return {
+        'level': level,
+        'creature': creature,
+        'threshold': lo,
+        'win_rate': rates.get(lo),
+        'next_win_rate': rates.get(hi),
+        'iterations': iterations,
+        'seed': seed
+        }
+
+def load_table(path):
+    """
+    Reads a checkpoint file, skipping a last line left half written by an interruption.
+
+    Returns:
+        dict, {(level, creature): cell}
+    """
+    table = {}
+    if not os.path.exists(path):
+        return table
+    with open(path) as checkpoint:
+        for line in checkpoint:
+            try:
+                cell = json.loads(line)
+            except ValueError:
+                continue
+            table[(cell['level'], cell['creature'])] = cell
+    return table
+
+def sweep(protagonists, checkpoint, levels=range(1, 21), creatures=None, workers=None,
+            seed=None, **kwargs):
+    """
+    Runs find_threshold() for every level and creature that is not in the checkpoint yet.
+
+    Attributes:
+        protagonists: list, the character classes in the PC party
+        checkpoint: str, the file the finished cells are appended to and resumed from
+        levels: iterable, the party levels to sweep
+        creatures: list, the creatures to sweep, defaults to creature_list.json
+        workers: int, the number of worker processes, defaults to the number of CPUs
+        seed: int, the master seed; a resumed sweep keeps the seed of its checkpoint
+        kwargs: passed on to find_threshold() and probe()
+
+    Returns:
+        dict, {(level, creature): cell} for the whole grid; the cell of a creature that
+            is not in the catalog, or that failed, only holds its level, creature and
+            error
+    """
+    if creatures is None:
+        with open(CREATURE_LIST) as c_list:
+            creatures = json.load(c_list)
+    table = load_table(checkpoint)
+    if seed is None:
+        seeds = [cell['seed'] for cell in table.values()]
+        seed = seeds[0] if seeds else random.SystemRandom().getrandbits(64)
+
+    # a half written line is dropped by load_table(), so the file is rewritten before
+    # anything is appended to it, to the side first so an interruption loses nothing
+    with open(checkpoint + '.tmp', 'w') as out:
+        for cell in table.values():
+            out.write(json.dumps(cell) + '\n')
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+    catalog = load_catalog()
+    cells = [(lvl, c) for lvl in levels for c in creatures if (lvl, c) not in table]
+    for lvl, c in cells:
+        if c not in catalog:
+            table[(lvl, c)] = {'level': lvl, 'creature': c,
+                                'error': 'not in the monster catalog'}
+    cells = [(lvl, c) for lvl, c in cells if c in catalog]
+
+    with open(checkpoint, 'a') as out, ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(find_threshold, protagonists, lvl, c, seed, **kwargs):
+                    (lvl, c) for lvl, c in cells}
+        for f in as_completed(futures):
+            lvl, c = futures[f]
+            try:
+                cell = f.result()
+            except Exception as e:
+                # one failed cell must not cost the sweep the cells around it
+                table[(lvl, c)] = {'level': lvl, 'creature': c, 'error': repr(e)}
+                continue
+            out.write(json.dumps(cell) + '\n')
+            out.flush()
+            table[(lvl, c)] = cell
+    return table
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else 'sweep.jsonl'
+    characters = ['cleric', 'fighter', 'rogue', 'wizard']
+    grid = sweep(characters, path)
+    for (lvl, c), cell in sorted(grid.items()):
+        if 'error' in cell:
+            print(f"Level {lvl:2d}  {c:30s} failed: {cell['error']}")
+            continue
+        rate = cell['win_rate']
+        shown = f'{rate*100:5.1f}%' if rate is not None else '    -'
+        print(f"Level {lvl:2d}  {c:30s} {cell['threshold']:3d}  ({shown})")
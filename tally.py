@@ -0,0 +1,348 @@
+"""
+Keeps running totals of encounter results so a batch never has to hold the result of
+every iteration. A Tally takes results one at a time, uses the same memory however many
+it has seen, and can be merged with the tallies of other workers.
+
+The win rate of a tally comes with a Wilson score or Clopper-Pearson (exact binomial)
+confidence interval, which runner.tally_until() uses to stop a batch once the interval
+is narrow enough.
+
+A PairedTally keeps the totals of a baseline encounter and a variant of it run side by
+side, and the confidence interval of the difference in their win rates.
+"""
+
+from math import exp, lgamma, log, sqrt
+from statistics import NormalDist
+
+def wilson_interval(successes, trials, confidence=0.95):
+    """
+    The Wilson score interval of a binomial proportion.
+
+    Returns:
+        tuple, the lower and upper bounds of the interval
+    """
+    if not trials:
+        return (0.0, 1.0)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / trials
+    centre = p + z * z / (2 * trials)
+    spread = z * sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials))
+    scale = 1 + z * z / trials
+    return (max(0.0, (centre - spread) / scale), min(1.0, (centre + spread) / scale))
+
+def beta_cdf(x, a, b):
+    """
+    The regularized incomplete beta function I_x(a, b), worked out with Lentz's
+    continued fraction.
+    """
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        return 1 - beta_cdf(1 - x, b, a)
+    front = exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a * log(x) + b * log(1 - x)) / a
+    tiny = 1e-300
+    f, c, d = 1.0, 1.0, 0.0
+    for i in range(400):
+        m = i // 2
+        if i == 0:
+            num = 1.0
+        elif i % 2:
+            num = -((a + m) * (a + b + m) * x) / ((a + 2 * m) * (a + 2 * m + 1))
+        else:
+            num = (m * (b - m) * x) / ((a + 2 * m - 1) * (a + 2 * m))
+        d = 1 + num * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + num / c
+        c = c if abs(c) > tiny else tiny
+        f *= c * d
+        if abs(1 - c * d) < 1e-12:
+            break
+    return front * (f - 1)
+
+def beta_ppf(q, a, b):
+    # the inverse of beta_cdf in x, found by bisection
+    lo, hi = 0.0, 1.0
+    for i in range(60):
+        mid = (lo + hi) / 2
+        if beta_cdf(mid, a, b) < q:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+def clopper_pearson_interval(successes, trials, confidence=0.95):
+    """
+    The Clopper-Pearson interval of a binomial proportion, which never covers less than
+    the confidence asked for.
+
+    Returns:
+        tuple, the lower and upper bounds of the interval
+    """
+    if not trials:
+        return (0.0, 1.0)
+    alpha = 1 - confidence
+    lower = beta_ppf(alpha / 2, successes, trials - successes + 1) if successes else 0.0
+    upper = (beta_ppf(1 - alpha / 2, successes + 1, trials - successes)
+                if successes < trials else 1.0)
+    return (lower, upper)
+
+INTERVALS = {'wilson': wilson_interval, 'clopper-pearson': clopper_pearson_interval}
+
+class Tally():
+    """
+    Running totals of the results of many runs of one encounter.
+
+    Attributes:
+        bins: int, the number of equal bins the HP a PC has left is counted in, as a
+            share of its full HP
+        iterations: int, the number of results added
+        wins: int, the number of party wins
+        survivors: dict, {number of surviving PCs: number of wins}
+        alive: dict, {PC class: number of wins it survived}
+        hp: dict, {PC class: list, number of wins it survived with each share of HP}
+        rounds, mean, m2: the count, mean and sum of squared deviations (Welford) of the
+            rounds it took to finish an encounter
+        seed: int, the master seed of the batch the results came from, if known, so any
+            of its iterations can be replayed with runner.replay()
+    """
+
+    def __init__(self, bins=10):
+        self.bins = bins
+        self.iterations = 0
+        self.wins = 0
+        self.survivors = {}
+        self.alive = {}
+        self.hp = {}
+        self.rounds = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.seed = None
+
+    def add(self, result, rounds=None):
+        """
+        Counts the result of a single encounter.
+
+        Attributes:
+            result: dict, what Encounter.combat() returned, {PC class: (hp, base_hp)} on
+                a win and None otherwise
+            rounds: int, the number of rounds the encounter took, if known
+        """
+        self.iterations += 1
+        if rounds is not None:
+            self.rounds += 1
+            delta = rounds - self.mean
+            self.mean += delta / self.rounds
+            self.m2 += delta * (rounds - self.mean)
+        if not result:
+            return
+        self.wins += 1
+        self.survivors[len(result)] = self.survivors.get(len(result), 0) + 1
+        for name, (hp, base_hp) in result.items():
+            self.alive[name] = self.alive.get(name, 0) + 1
+            if name not in self.hp:
+                self.hp[name] = [0] * self.bins
+            b = min(max(int(hp / base_hp * self.bins), 0), self.bins - 1)
+            self.hp[name][b] += 1
+
+    def merge(self, other):
+        """
+        Adds the totals of another Tally, such as one kept by another worker, to this one.
+
+        Returns:
+            self, so tallies can be folded together
+        """
+        if other.bins != self.bins:
+            raise ValueError('only tallies with the same number of HP bins can be merged')
+        self.iterations += other.iterations
+        self.wins += other.wins
+        for k, v in other.survivors.items():
+            self.survivors[k] = self.survivors.get(k, 0) + v
+        for k, v in other.alive.items():
+            self.alive[k] = self.alive.get(k, 0) + v
+        for k, v in other.hp.items():
+            mine = self.hp.setdefault(k, [0] * self.bins)
+            self.hp[k] = [a + b for a, b in zip(mine, v)]
+
+        # Chan et al.'s update for combining two sets of Welford totals
+        n = self.rounds + other.rounds
+        if n:
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * self.rounds * other.rounds / n
+            self.mean += delta * other.rounds / n
+            self.rounds = n
+        return self
+
+    def to_dict(self):
+        """
+        Returns:
+            dict, the totals as plain JSON types, which from_dict() turns back into a Tally
+        """
+        data = dict(vars(self))
+        data['survivors'] = {str(k): v for k, v in self.survivors.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns:
+            Tally, the totals saved by to_dict()
+        """
+        tally = cls(data['bins'])
+        vars(tally).update(data)
+        tally.survivors = {int(k): v for k, v in data['survivors'].items()}
+        tally.hp = {k: list(v) for k, v in data['hp'].items()}
+        return tally
+
+    def win_rate(self):
+        """
+        Returns:
+            float, the share of encounters the party won
+        """
+        return self.wins / self.iterations if self.iterations else 0.0
+
+    def win_interval(self, confidence=0.95, method='wilson'):
+        """
+        Attributes:
+            confidence: float, the confidence level of the interval
+            method: str, 'wilson' or 'clopper-pearson'
+
+        Returns:
+            tuple, the lower and upper bounds of the confidence interval of the win rate
+        """
+        return INTERVALS[method](self.wins, self.iterations, confidence)
+
+    def survival_rate(self, name):
+        """
+        Returns:
+            float, the share of encounters the party won with the PC class name alive
+        """
+        return self.alive.get(name, 0) / self.iterations if self.iterations else 0.0
+
+    def survivor_rate(self, count):
+        """
+        Returns:
+            float, the share of encounters the party won with exactly count PCs alive
+        """
+        return self.survivors.get(count, 0) / self.iterations if self.iterations else 0.0
+
+    def rounds_variance(self):
+        """
+        Returns:
+            float, the sample variance of the number of rounds an encounter took
+        """
+        return self.m2 / (self.rounds - 1) if self.rounds > 1 else 0.0
+
+class PairedTally():
+    """
+    Running totals of the results of a baseline encounter and a variant of it, run in
+    pairs with common random numbers, see compare.py. The difference in their win rates
+    is worked out over the pairs, so the luck the two fights of a pair share cancels out
+    of it.
+
+    Attributes:
+        iterations: int, the number of pairs added
+        both: int, the pairs the party won in both
+        base_only: int, the pairs the party only won in the baseline
+        variant_only: int, the pairs the party only won in the variant
+        seed: int, the master seed of the batch the pairs came from, if known
+    """
+
+    def __init__(self):
+        self.iterations = 0
+        self.both = 0
+        self.base_only = 0
+        self.variant_only = 0
+        self.seed = None
+
+    def add(self, base, variant):
+        """
+        Counts a pair of results.
+
+        Attributes:
+            base, variant: boolean, True if the party won the fight of the baseline and of
+                the variant
+        """
+        self.iterations += 1
+        if base and variant:
+            self.both += 1
+        elif base:
+            self.base_only += 1
+        elif variant:
+            self.variant_only += 1
+
+    def merge(self, other):
+        """
+        Adds the totals of another PairedTally, such as one kept by another worker.
+
+        Returns:
+            self, so tallies can be folded together
+        """
+        self.iterations += other.iterations
+        self.both += other.both
+        self.base_only += other.base_only
+        self.variant_only += other.variant_only
+        return self
+
+    def base_rate(self):
+        # the win rate of the baseline
+        n = self.iterations
+        return (self.both + self.base_only) / n if n else 0.0
+
+    def variant_rate(self):
+        # the win rate of the variant
+        n = self.iterations
+        return (self.both + self.variant_only) / n if n else 0.0
+
+    def delta(self):
+        """
+        Returns:
+            float, the win rate of the variant less the win rate of the baseline
+        """
+        n = self.iterations
+        return (self.variant_only - self.base_only) / n if n else 0.0
+
+    def delta_variance(self):
+        """
+        Returns:
+            float, the sample variance of the difference within a pair, which only the
+                pairs that went different ways add to
+        """
+        n = self.iterations
+        if n < 2:
+            return 0.0
+        d = self.delta()
+        return ((self.base_only + self.variant_only) / n - d * d) * n / (n - 1)
+
+    def independent_variance(self):
+        """
+        Returns:
+            float, the variance the difference would have if the baseline and the variant
+                were run independently of each other
+        """
+        p, q = self.base_rate(), self.variant_rate()
+        return p * (1 - p) + q * (1 - q)
+
+    def delta_interval(self, confidence=0.95):
+        """
+        Returns:
+            tuple, the lower and upper bounds of the normal confidence interval of delta()
+        """
+        if not self.iterations:
+            return (-1.0, 1.0)
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        spread = z * sqrt(self.delta_variance() / self.iterations)
+        d = self.delta()
+        return (max(-1.0, d - spread), min(1.0, d + spread))
+
+    def efficiency(self):
+        """
+        Returns:
+            float, how many times the iterations running the two independently would take
+                for an interval as narrow as the paired one
+        """
+        paired = self.delta_variance()
+        if not paired:
+            return float('inf') if self.independent_variance() else 1.0
+        return self.independent_variance() / paired
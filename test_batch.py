@@ -0,0 +1,32 @@
+"""
+Checks that the lock-step NumPy engine in batch.py wins as often as Encounter.combat(),
+at levels where the wizard falls back on disintegrate once its slots run out.
+
+Run with:
+    python -m pytest test_batch.py
+"""
+
+from math import sqrt
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from batch import BatchEncounter
+from runner import CHARACTERS, tally_many
+
+@pytest.mark.parametrize('level, antagonists', [
+    (13, {'Adult Red Dragon': 2}),
+    (13, {'Troll': 14}),
+    (16, {'Adult Red Dragon': 3})
+    ])
+def test_batch_matches_encounter(level, antagonists):
+    batch = BatchEncounter(CHARACTERS, level, antagonists, seed=1)
+    trials = 4000
+    p = batch.survival(batch.run(trials))['win']
+    iterations = 2000
+    q = tally_many(CHARACTERS, level, antagonists, iterations, workers=1, seed=1).win_rate()
+
+    # the two engines roll different dice, so they only agree within sampling error
+    pooled = (p * trials + q * iterations) / (trials + iterations)
+    error = sqrt(pooled * (1 - pooled) * (1 / trials + 1 / iterations))
+    assert abs(p - q) <= 4 * error + 0.005